@@ -0,0 +1,345 @@
+# Times the model, storage and views over synthetic trips and compares the
+# results with baseline.json.
+#
+#     python benchmarks/bench.py                  run and check the baseline
+#     python benchmarks/bench.py --save           record a new baseline
+#     python benchmarks/bench.py --quick -k view  a quick look at the views
+#
+# N is the number of stays in a trip and M the number of trips in the data
+# dir. Times are the best of several runs, and are scaled by a fixed
+# calibration workload before being compared, so a baseline recorded on
+# one machine can be checked on another.
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+from datetime import timedelta
+from pathlib import Path
+
+HERE = Path(__file__).resolve().parent
+# The app reads its config when imported, so it must not find the user's.
+SCRATCH = Path(tempfile.mkdtemp(prefix='hiker-bench-'))
+os.environ['XDG_CONFIG_HOME'] = str(SCRATCH / 'config')
+os.environ['XDG_DATA_HOME'] = str(SCRATCH / 'data')
+os.makedirs(SCRATCH / 'data', exist_ok=True)
+
+from generate import make_data_dir, make_itinerary, make_stay  # noqa: E402
+
+import hiker  # noqa: E402
+from hiker.config import Config  # noqa: E402
+
+BASELINE = HERE / 'baseline.json'
+# Shared machines easily vary by half from run to run; the check is for
+# real slowdowns, like something going quadratic.
+DEFAULT_TOLERANCE = 1.0
+# Differences smaller than this are timer noise, whatever the ratio.
+MIN_DELTA = 20e-6
+STAYS = (10, 100, 1000)
+TRIPS = (10, 100, 1000)
+QUICK_STAYS = (10, 100)
+QUICK_TRIPS = (10, 100)
+# Stays per trip in the data dirs used for the M series.
+TRIP_STAYS = 10
+
+
+def measure(func, min_time=0.05, repeat=5):
+    # Like timeit: find a number of calls that takes at least min_time,
+    # then keep the best of a few batches of that many.
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            break
+        number *= 10 if elapsed < min_time / 10 else 2
+    best = elapsed
+    for _ in range(repeat - 1):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        best = min(best, time.perf_counter() - start)
+    return best / number
+
+
+def calibration():
+    rnd = random.Random(0)
+    values = [rnd.random() for _ in range(20000)]
+
+    def work():
+        table = {}
+        for value in sorted(values):
+            table[int(value * 1000)] = value
+        return len(table)
+
+    return measure(work, repeat=15)
+
+
+def model_benchmarks(stays):
+    itinerary = make_itinerary(stays, seed=stays)
+    ids = [item.id for item in itinerary.traverse()]
+    rnd = random.Random(stays)
+    lookups = [rnd.choice(ids) for _ in range(1000)]
+    # Lands in the middle of the trip, so half the stays sit either side.
+    middle = itinerary.stays[len(itinerary.stays) // 2]
+    stay = make_stay(
+        rnd,
+        middle.site.location + 0.5,
+        middle.arrive_datetime + timedelta(hours=1),
+    )
+
+    def add_remove():
+        itinerary.add_stay(stay)
+        itinerary.remove_stay(stay)
+
+    return {
+        'traverse': lambda: list(itinerary.traverse()),
+        'get_item x1000': lambda: [itinerary.get_item(i) for i in lookups],
+        'add_stay+remove_stay': add_remove,
+        'autofill_routes': itinerary.autofill_routes,
+    }
+
+
+def use_data_dir(cfg):
+    import yaml
+    path = Path(cfg['data_dir']) / 'config.yaml'
+    with open(path, 'w') as fh:
+        yaml.dump(cfg, fh)
+    hiker.config = Config(path)
+    hiker.cache.clear()
+
+
+def itinerary_benchmarks(cfg, itinerary_id):
+    use_data_dir(cfg)
+    client = hiker.app.test_client()
+    with hiker.app.test_request_context():
+        itinerary = hiker.load_itinerary(itinerary_id)
+
+    def load_itinerary():
+        with hiker.app.test_request_context():
+            hiker.cache.clear()
+            hiker.load_itinerary(itinerary_id)
+
+    def dump_itinerary():
+        with hiker.app.test_request_context():
+            hiker.dump_itinerary(itinerary)
+
+    def view(url):
+        def get():
+            response = client.get(url)
+            assert response.status_code == 200, (url, response.status_code)
+            return response.data
+        return get
+
+    return {
+        'load_itinerary': load_itinerary,
+        'dump_itinerary': dump_itinerary,
+        'overview view': view(f'/overview/{itinerary_id}'),
+        'export view': view(f'/export/{itinerary_id}'),
+    }
+
+
+def catalog_benchmarks(cfg):
+    use_data_dir(cfg)
+    client = hiker.app.test_client()
+
+    def load_view():
+        response = client.get('/load')
+        assert response.status_code == 200, response.status_code
+        return response.data
+
+    # The first request builds the catalog.
+    load_view()
+    return {'load view': load_view}
+
+
+def run(args):
+    results = {}
+    selected = args.keyword
+
+    def record(label, size, benchmarks):
+        for name, func in benchmarks.items():
+            if selected and selected not in name:
+                continue
+            key = f'{name}[{label}={size}]'
+            results[key] = measure(func, args.min_time)
+            print(f'  {key:<40} {format_time(results[key])}', flush=True)
+
+    for stays in args.stays:
+        print(f'N={stays}', flush=True)
+        record('N', stays, model_benchmarks(stays))
+        cfg, ids = make_data_dir(
+            SCRATCH / f'stays-{stays}',
+            1,
+            stays,
+            args.storage,
+        )
+        record('N', stays, itinerary_benchmarks(cfg, ids[0]))
+    for trips in args.trips:
+        print(f'M={trips}', flush=True)
+        cfg, _ = make_data_dir(
+            SCRATCH / f'trips-{trips}',
+            trips,
+            TRIP_STAYS,
+            args.storage,
+        )
+        record('M', trips, catalog_benchmarks(cfg))
+    return results
+
+
+def format_time(seconds):
+    if seconds >= 1:
+        return f'{seconds:8.2f} s '
+    if seconds >= 1e-3:
+        return f'{seconds * 1e3:8.2f} ms'
+    return f'{seconds * 1e6:8.1f} µs'
+
+
+def scaling(results):
+    # How each benchmark grows: the exponent k in time ~ size ** k between
+    # the smallest and largest size it was run at.
+    series = {}
+    for key, seconds in results.items():
+        name, _, size = key[:-1].partition('[')
+        label, _, size = size.partition('=')
+        series.setdefault((name, label), []).append((int(size), seconds))
+    print('scaling')
+    for (name, label), points in series.items():
+        points.sort()
+        line = '   '.join(
+            f'{label}={size}: {format_time(seconds).strip()}'
+            for size, seconds in points
+        )
+        if len(points) > 1:
+            (n1, t1), (n2, t2) = points[0], points[-1]
+            exponent = math.log(t2 / t1) / math.log(n2 / n1)
+            line += f'   ~{label}^{exponent:.2f}'
+        print(f'  {name:<24} {line}')
+
+
+def compare(results, cal, baseline):
+    # Returns the benchmarks slower than their baseline allows.
+    speed = cal / baseline['calibration']
+    tolerances = baseline.get('tolerances', {})
+    regressions = []
+    for key, seconds in results.items():
+        if key not in baseline['results']:
+            continue
+        expected = baseline['results'][key] * speed
+        name = key.partition('[')[0]
+        tolerance = tolerances.get(
+            name,
+            baseline.get('tolerance', DEFAULT_TOLERANCE),
+        )
+        if (
+            seconds > expected * (1 + tolerance)
+            and seconds - expected > MIN_DELTA
+        ):
+            regressions.append((key, seconds, expected, tolerance))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmark hiker over synthetic trips.',
+    )
+    parser.add_argument(
+        '--stays',
+        type=lambda value: [int(n) for n in value.split(',')],
+        help=f'sizes of trip to time (default {",".join(map(str, STAYS))})',
+    )
+    parser.add_argument(
+        '--trips',
+        type=lambda value: [int(n) for n in value.split(',')],
+        help=f'sizes of data dir to time (default {",".join(map(str, TRIPS))})',
+    )
+    parser.add_argument(
+        '--quick',
+        action='store_true',
+        help='only the smaller sizes, with shorter runs',
+    )
+    parser.add_argument(
+        '-k',
+        dest='keyword',
+        help='only benchmarks whose name contains this',
+    )
+    parser.add_argument('--storage', default='pickle')
+    parser.add_argument('--baseline', type=Path, default=BASELINE)
+    parser.add_argument(
+        '--save',
+        action='store_true',
+        help='write the results to the baseline instead of checking them',
+    )
+    parser.add_argument(
+        '--tolerance',
+        type=float,
+        help='allowed slowdown, as a fraction, for benchmarks without '
+             'their own in the baseline',
+    )
+    args = parser.parse_args()
+    if args.stays is None:
+        args.stays = QUICK_STAYS if args.quick else STAYS
+    if args.trips is None:
+        args.trips = QUICK_TRIPS if args.quick else TRIPS
+    args.min_time = 0.02 if args.quick else 0.05
+
+    # Machine speed drifts over a run, so it is calibrated at both ends.
+    try:
+        cal = calibration()
+        results = run(args)
+        cal = (cal + calibration()) / 2
+    finally:
+        shutil.rmtree(SCRATCH, ignore_errors=True)
+    print(f'calibration {format_time(cal)}')
+    scaling(results)
+
+    if args.save:
+        previous = {}
+        if args.baseline.exists():
+            previous = json.loads(args.baseline.read_text())
+        baseline = {
+            'python': platform.python_version(),
+            'storage': args.storage,
+            'calibration': cal,
+            'tolerance': (
+                args.tolerance
+                if args.tolerance is not None
+                else previous.get('tolerance', DEFAULT_TOLERANCE)
+            ),
+            'tolerances': previous.get('tolerances', {}),
+            'results': results,
+        }
+        args.baseline.write_text(json.dumps(baseline, indent=2) + '\n')
+        print(f'saved {args.baseline}')
+        return 0
+    if not args.baseline.exists():
+        print(f'no baseline at {args.baseline}; run with --save to make one')
+        return 0
+    baseline = json.loads(args.baseline.read_text())
+    if baseline.get('storage', 'pickle') != args.storage:
+        print(f'the baseline is for {baseline["storage"]} storage')
+        return 2
+    if args.tolerance is not None:
+        baseline['tolerance'] = args.tolerance
+    regressions = compare(results, cal, baseline)
+    for key, seconds, expected, tolerance in regressions:
+        print(
+            f'REGRESSION {key}: {format_time(seconds).strip()}, '
+            f'baseline {format_time(expected).strip()} '
+            f'(+{seconds / expected - 1:.0%}, allowed +{tolerance:.0%})'
+        )
+    checked = sum(key in baseline['results'] for key in results)
+    print(f'{checked} checked against the baseline, '
+          f'{len(regressions)} regressions')
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
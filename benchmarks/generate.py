@@ -0,0 +1,94 @@
+import random
+import sys
+from datetime import datetime, timedelta
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from hiker.logic import sites, events  # noqa: E402
+from hiker.logic.features import Features  # noqa: E402
+from hiker.storage import open_storage  # noqa: E402
+
+START = datetime(2024, 6, 1, 8)
+WORDS = (
+    'lake', 'ridge', 'meadow', 'pass', 'creek', 'spring', 'bluff', 'camp',
+    'saddle', 'basin', 'falls', 'canyon', 'summit', 'junction', 'flat',
+)
+
+
+def name(rnd, words=2):
+    return ' '.join(rnd.choice(WORDS) for _ in range(words)).title()
+
+
+def make_stay(rnd, location, arrive, water=0.3, permits=0.1):
+    site = sites.Site(
+        location,
+        rnd.randint(2000, 11000),
+        Features.WATER if rnd.random() < water else Features.NONE,
+        name(rnd),
+    )
+    return events.Stay(
+        site,
+        arrive,
+        arrive + timedelta(hours=14),
+        note=name(rnd, 6) if rnd.random() < 0.5 else '',
+        needs_permit=rnd.random() < permits,
+    )
+
+
+def make_itinerary(stays, seed=0, water=0.3, permits=0.1):
+    # A trip with one stay per day, every 5 to 15 miles, with water, permits,
+    # notes and renamed routes sprinkled in. The same seed always gives the
+    # same trip, apart from the random item ids.
+    rnd = random.Random(seed)
+    location = 0.0
+    day = START
+    stay_list = []
+    for _ in range(stays):
+        location += round(rnd.uniform(5, 15), 1)
+        day += timedelta(days=1)
+        stay_list.append(
+            make_stay(rnd, location, day.replace(hour=18), water, permits),
+        )
+    itinerary = sites.Itinerary(
+        events.StartTrailheadEvent(
+            START,
+            sites.StartTrailhead(rnd.randint(2000, 9000), name=name(rnd)),
+        ),
+        events.EndTrailheadEvent(
+            day + timedelta(days=1),
+            sites.EndTrailhead(
+                location + round(rnd.uniform(5, 15), 1),
+                rnd.randint(2000, 9000),
+                name=name(rnd),
+            ),
+        ),
+        stays=stay_list,
+        name=f'{name(rnd)} Loop',
+    )
+    for route in itinerary.routes:
+        if rnd.random() < water:
+            route.add_water()
+        if rnd.random() < 0.2:
+            route.name = f'{name(rnd)} Trail'
+            route.note = name(rnd, 8)
+    return itinerary
+
+
+def make_data_dir(path, trips, stays, storage='pickle', seed=0):
+    # Fills path with `trips` itineraries of `stays` stays each and returns
+    # the config for it and their ids.
+    path = Path(path)
+    path.mkdir(parents=True, exist_ok=True)
+    cfg = {'data_dir': str(path), 'storage': storage}
+    store = open_storage(cfg)
+    ids = []
+    for i in range(trips):
+        itinerary = make_itinerary(stays, seed=seed + i)
+        # Ids are only seven digits, so a thousand trips can easily share
+        # one.
+        while itinerary.id in ids:
+            itinerary.id = sites.uuid4()
+        store.save(itinerary)
+        ids.append(itinerary.id)
+    return cfg, ids
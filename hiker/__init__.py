@@ -1,99 +1,455 @@
-import pickle
+import os
 from pathlib import Path
-from datetime import datetime
+from datetime import date, datetime, time
+from time import perf_counter
 
-import yaml
-from appdirs import user_data_dir, user_config_dir
-from dateparser import parse
 from flask import (
     Flask,
+    Response,
+    g,
     render_template,
+    stream_template,
     url_for,
     redirect,
     request,
+    template_rendered,
+    before_render_template,
 )
+from werkzeug.exceptions import Conflict, NotFound
 
+from . import artifacts, locking, metrics
 from .logic import sites, events
-from .info import app_name
+from .logic.batch import BatchError, apply_batch
+from .logic.edits import apply_edit
+from .forms import parse_datetime
+from .info import app_name, version
+from .config import Config, config_path
+from .cache import ItineraryCache
+from .catalog import Catalog, catalog_path
+from .cards import render_cards
+from .searchindex import SearchIndex
+from .httpcache import (
+    cache_static,
+    compress,
+    conditional,
+    make_etag,
+    static_url as fingerprinted_url,
+)
+from .storage import ItineraryNotFound, VersionConflict, open_storage
 
 app = Flask(__name__)
 
+DEFAULT_CACHE_SIZE = 32
+DEFAULT_PAGE_SIZE = 50
 
-def make_default_cfg(file):
-    data_dir = Path(user_data_dir()) / app_name
-    if not data_dir.exists():
-        data_dir.mkdir()
-    cfg = {
-        'data_dir': str(data_dir.absolute()),
-    }
-    with open(file, 'w') as fh:
-        yaml.dump(cfg, fh)
-    return Path(file).exists()
+
+config = Config(config_path())
 
 
 def get_cfg():
-    cfgdir = Path(user_config_dir()) / app_name
-    cfgfile = Path(user_config_dir()) / app_name / 'config.yaml'
-    if not cfgdir.exists():
-        cfgdir.mkdir(parents=True, exist_ok=True)
-    if not cfgfile.exists():
-        if not make_default_cfg(cfgfile):
-            raise IOError('Could not create config file')
-    with open(cfgfile, 'r') as fh:
-        return yaml.safe_load(fh)
+    with metrics.timed('config'):
+        cfg = config.get()
+    # So a reload of config.yaml also resizes the cache.
+    size = cfg.get('cache_size', DEFAULT_CACHE_SIZE)
+    if size != cache.maxsize:
+        cache.resize(size)
+    return cfg
 
 
 def get_data_dir():
+    return Path(get_cfg()['data_dir'])
+
+
+cache = ItineraryCache(config.get().get('cache_size', DEFAULT_CACHE_SIZE))
+artifact_queue = artifacts.ArtifactQueue()
+catalogs = {}
+search_indexes = {}
+# Search indexes already checked against storage by this process; after
+# that, saves and deletes keep them up to date.
+checked_indexes = set()
+storages = {}
+
+
+def _after_fork():
+    # Connections, locks and threads don't survive a fork, so each worker
+    # process starts with its own storage, indexes and cache rather than
+    # sharing its parent's.
+    global cache, artifact_queue
+    storages.clear()
+    catalogs.clear()
+    search_indexes.clear()
+    checked_indexes.clear()
+    cache = ItineraryCache(cache.maxsize)
+    artifact_queue = artifacts.ArtifactQueue()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork)
+
+
+def get_storage():
     cfg = get_cfg()
-    return Path(cfg['data_dir'])
+    key = (
+        cfg.get('storage', 'pickle'),
+        cfg['data_dir'],
+        cfg.get('sqlite_path'),
+    )
+    if key not in storages:
+        storages[key] = open_storage(cfg)
+    return storages[key]
 
 
-def load_itinerary(itinerary_id):
+def get_catalog():
     data_dir = get_data_dir()
-    with open(data_dir / Path(str(itinerary_id)+'.pkl'), 'rb') as fh:
-        itinerary = pickle.load(fh)
-    return itinerary
+    if data_dir not in catalogs:
+        catalogs[data_dir] = Catalog(catalog_path(data_dir))
+    return catalogs[data_dir]
 
 
-def dump_itinerary(itinerary):
+def get_search_index():
     data_dir = get_data_dir()
-    with open(data_dir / Path(str(itinerary.id)+'.pkl'), 'wb') as fh:
-        return pickle.dump(itinerary, fh)
+    if data_dir not in search_indexes:
+        search_indexes[data_dir] = SearchIndex(data_dir / 'search.sqlite')
+    return search_indexes[data_dir]
+
+
+def rebuild_catalog():
+    storage = get_storage()
+    get_catalog().rebuild(
+        (storage.load(itinerary_id), storage.mtime(itinerary_id))
+        for itinerary_id in storage.ids()
+    )
+
+
+def rebuild_search_index():
+    storage = get_storage()
+    get_search_index().rebuild(
+        storage.load(itinerary_id) for itinerary_id in storage.ids()
+    )
+
+
+def update_indexes(itinerary, changed=None):
+    # Exports, stats and catalog entries are built by artifact_workers
+    # background processes; with 0 they are computed when asked for.
+    cfg = get_cfg()
+    background = cfg.get('artifact_workers', artifacts.DEFAULT_WORKERS) > 0
+    with metrics.timed('index'):
+        catalog = get_catalog()
+        # The artifact worker updates the catalog, but a new itinerary is
+        # added straight away so that it is listed from the start.
+        if not background or itinerary.id not in catalog:
+            catalog.update(itinerary, get_storage().mtime(itinerary.id))
+        get_search_index().update(itinerary, changed)
+    if background:
+        artifact_queue.submit(cfg, itinerary.id)
+
+
+def current_artifacts(itinerary_id):
+    # The precomputed exports and stats, if they are up to date.
+    return artifacts.load(
+        get_data_dir(),
+        itinerary_id,
+        get_storage().stamp(itinerary_id),
+    )
+
+
+def load_itinerary(itinerary_id):
+    storage = get_storage()
+    stamp = storage.stamp(itinerary_id)
+    itinerary = cache.get(itinerary_id, stamp)
+    if itinerary is None:
+        with metrics.timed('load'):
+            itinerary = storage.load(itinerary_id)
+        metrics.STORAGE_OPERATIONS.inc(operation='load')
+        cache.put(itinerary_id, stamp, itinerary)
+    return itinerary
+
+
+def load_for_edit(itinerary_id):
+    # Writers get their own copy, straight from storage, and only a saved
+    # copy goes into the cache, so the cached copies readers share are
+    # never changed in place. The lock, held until the request ends, keeps
+    # this process's threads from editing the same itinerary at once; other
+    # processes are caught by the version check on save.
+    locks = g.setdefault('edit_locks', {})
+    if itinerary_id not in locks:
+        lock = locking.named_lock(f'edit-{itinerary_id}')
+        lock.acquire()
+        locks[itinerary_id] = lock
+    with metrics.timed('load'):
+        itinerary = get_storage().load(itinerary_id)
+    metrics.STORAGE_OPERATIONS.inc(operation='load')
+    return itinerary
+
+
+def schedule_changes(itinerary, changed):
+    cfg = get_cfg()
+    if not cfg.get('auto_schedule'):
+        return []
+    from .logic.schedule import PaceModel, reschedule
+    return reschedule(itinerary, PaceModel.from_config(cfg), changed)
+
+
+def save_itinerary(itinerary, changed=None):
+    storage = get_storage()
+    with metrics.timed('save'):
+        stamp = storage.save(itinerary, changed)
+    metrics.STORAGE_OPERATIONS.inc(operation='save')
+    cache.put(itinerary.id, stamp, itinerary)
+    update_indexes(itinerary, changed)
+
+
+def dump_itinerary(itinerary, changed=None):
+    if changed is not None:
+        changed = [*changed, *schedule_changes(itinerary, changed)]
+    save_itinerary(itinerary, changed)
+
+
+def edit_itinerary(itinerary, item_id, fields):
+    changed = apply_edit(itinerary, item_id, fields)
+    rescheduled = schedule_changes(itinerary, changed)
+    if rescheduled or len(changed) > 1:
+        # The journal only replays the edit itself, so times derived from
+        # it, and routes split or merged by it (which would get new ids on
+        # replay), go out in a snapshot along with it.
+        save_itinerary(itinerary, [*changed, *rescheduled])
+        return
+    storage = get_storage()
+    with metrics.timed('record'):
+        stamp = storage.record(itinerary, item_id, fields, changed)
+    metrics.STORAGE_OPERATIONS.inc(operation='record')
+    if stamp is None:
+        # The edit was merged onto a newer version saved by another worker,
+        # so our copy is stale and the indexes are built from the saved one.
+        cache.discard(itinerary.id)
+        update_indexes(storage.load(itinerary.id))
+        return
+    cache.put(itinerary.id, stamp, itinerary)
+    update_indexes(itinerary, changed)
+
+
+@app.teardown_request
+def release_edit_locks(exc):
+    for lock in g.pop('edit_locks', {}).values():
+        lock.release()
+
+
+@app.before_request
+def start_timer():
+    g.request_started = perf_counter()
+    g.profile = metrics.start_profile(get_cfg().get('profile_rate', 0))
+
+
+@app.teardown_request
+def finish_profile(exc):
+    profile = g.pop('profile', None)
+    if profile is not None:
+        cfg = get_cfg()
+        metrics.finish_profile(
+            profile,
+            perf_counter() - g.request_started,
+            cfg.get('profile_threshold', metrics.DEFAULT_PROFILE_THRESHOLD),
+            get_data_dir() / 'profiles',
+            request.endpoint or 'none',
+            cfg.get('profile_keep', metrics.DEFAULT_PROFILE_KEEP),
+        )
+
+
+# Registered first so that it runs last, after compression. Streamed
+# responses are timed up to their first byte.
+@app.after_request
+def record_request(response):
+    if 'request_started' in g:
+        metrics.REQUEST_SECONDS.observe(
+            perf_counter() - g.request_started,
+            endpoint=request.endpoint or 'none',
+            method=request.method,
+            status=response.status_code,
+        )
+    return response
+
+
+@app.after_request
+def finish_response(response):
+    return compress(cache_static(response))
+
+
+@before_render_template.connect_via(app)
+def start_render(sender, template, context, **extra):
+    g.setdefault('render_started', []).append(perf_counter())
+
+
+@template_rendered.connect_via(app)
+def finish_render(sender, template, context, **extra):
+    started = g.get('render_started')
+    if started:
+        metrics.PHASE_SECONDS.observe(
+            perf_counter() - started.pop(),
+            phase='render',
+        )
+
+
+@metrics.registry.collector
+def cache_metrics():
+    stats = cache.stats
+    return [
+        (f'hiker_cache_{name}_total', 'counter', f'Itinerary cache {name}.',
+         stats[name])
+        for name in ('hits', 'misses', 'evictions')
+    ] + [
+        ('hiker_cache_size', 'gauge', 'Itineraries in the cache.',
+         stats['size']),
+        ('hiker_cache_maxsize', 'gauge', 'Capacity of the cache.',
+         stats['maxsize']),
+        ('hiker_config_reloads_total', 'counter',
+         'Times config.yaml was read.', config.reloads),
+    ]
+
+
+@app.template_global()
+def static_url(filename):
+    return fingerprinted_url(app.static_folder, filename)
+
+
+def page_etag(*parts):
+    # Pages link the stylesheet by fingerprint, so a changed stylesheet or
+    # release must change every tag as well.
+    return make_etag(version, static_url('style.css'), *parts)
+
+
+def itinerary_etag(view, itinerary_id, *extra):
+    stamp = get_storage().stamp(itinerary_id)
+    return page_etag(view, itinerary_id, stamp, *extra)
+
+
+@app.errorhandler(ItineraryNotFound)
+def itinerary_not_found(exc):
+    return NotFound()
+
+
+@app.errorhandler(VersionConflict)
+def version_conflict(exc):
+    cache.discard(exc.itinerary_id)
+    return Conflict(
+        'This itinerary was changed by someone else. '
+        'Reload it and try again.'
+    )
 
 
 @app.route('/overview/<int:itinerary_id>', methods=['POST', 'GET'])
 def overview(itinerary_id):
-    itinerary = load_itinerary(itinerary_id)
-    return render_template(
-        'overview.html',
-        itinerary=load_itinerary(itinerary_id),
-        routes=[
-            i.id
-            for i in itinerary.traverse()
-            if isinstance(i, sites.Route)
-        ],
-        stays=[
-            i.id
-            for i in itinerary.traverse()
-            if isinstance(i, events.Stay)
-        ],
-        trailheads=[
-            i.id for i in itinerary.traverse()
-            if (
-                isinstance(i, events.StartTrailheadEvent)
-                or isinstance(i, events.EndTrailheadEvent)
-            )
-        ],
+
+    def render():
+        itinerary = load_itinerary(itinerary_id)
+        # Building each card from the trip and its water index, and rendering
+        # the fragments of any cards that changed since they were cached.
+        with metrics.timed('cards'):
+            cards = render_cards(itinerary)
+        return render_template(
+            'overview.html',
+            itinerary=itinerary,
+            cards=cards,
+            water_gap=itinerary.water_index().max_gap(),
+        )
+
+    return conditional(
+        itinerary_etag('overview', itinerary_id),
+        render,
+        get_storage().mtime(itinerary_id),
     )
 
 
 @app.route('/load', methods=['POST', 'GET'])
 def load():
-    itineraries = []
-    for path in get_data_dir().glob('*.pkl'):
-        itinerary_id = int(path.stem)
-        itineraries.append(load_itinerary(itinerary_id))
-    return render_template('load.html', itineraries=itineraries)
+    catalog = get_catalog()
+    if not catalog.in_sync(get_storage().ids()):
+        rebuild_catalog()
+    sort = request.args.get('sort', 'mtime')
+    order = request.args.get('order', 'desc')
+    page = max(request.args.get('page', 1, type=int), 1)
+    per_page = max(
+        request.args.get('per_page', DEFAULT_PAGE_SIZE, type=int),
+        1,
+    )
+
+    def render():
+        try:
+            itineraries, total = catalog.page(
+                sort=sort,
+                reverse=(order == 'desc'),
+                page=page,
+                per_page=per_page,
+            )
+        except ValueError:
+            return redirect(url_for('load'))
+        return render_template(
+            'load.html',
+            itineraries=itineraries,
+            sort=sort,
+            order=order,
+            page=page,
+            per_page=per_page,
+            pages=max((total + per_page - 1) // per_page, 1),
+            total=total,
+        )
+
+    return conditional(
+        page_etag('load', catalog.stamp(), sort, order, page, per_page),
+        render,
+    )
+
+
+@app.route('/search', methods=['GET'])
+def search():
+    # /search?q=lake&kind=stay&from=2024-07-01&to=2024-07-31
+    #     &min_location=10&max_location=40&needs_permit=1&format=json
+    index = get_search_index()
+    if index.path not in checked_indexes:
+        if not index.in_sync(get_storage().ids()):
+            rebuild_search_index()
+        checked_indexes.add(index.path)
+    args = request.args
+    page = max(args.get('page', 1, type=int), 1)
+    per_page = max(args.get('per_page', DEFAULT_PAGE_SIZE, type=int), 1)
+    first_day = args.get('from', type=date.fromisoformat)
+    last_day = args.get('to', type=date.fromisoformat)
+    try:
+        results = index.search(
+            args.get('q', ''),
+            kind=args.get('kind') or None,
+            start=first_day and datetime.combine(first_day, time.min),
+            end=last_day and datetime.combine(last_day, time.max),
+            low=args.get('min_location', type=float),
+            high=args.get('max_location', type=float),
+            needs_permit=bool(args.get('needs_permit')),
+            # One extra to tell whether there is a next page.
+            limit=per_page + 1,
+            offset=(page - 1) * per_page,
+        )
+    except ValueError as exc:
+        return {'error': str(exc)}, 400
+    more = len(results) > per_page
+    results = results[:per_page]
+    if args.get('format') == 'json':
+        return {'results': results, 'page': page, 'more': more}
+    query = args.to_dict()
+    query.pop('page', None)
+    return render_template(
+        'search.html',
+        results=results,
+        query=query,
+        page=page,
+        more=more,
+    )
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics_view():
+    # Prometheus text format, for this worker process only.
+    return Response(
+        metrics.registry.render(),
+        content_type=metrics.CONTENT_TYPE,
+    )
 
 
 @app.route('/add/<int:itinerary_id>/<int:id>', methods=['POST'])
@@ -109,7 +465,7 @@ def add(itinerary_id, id):
 
 @app.route('/add/stay/<int:itinerary_id>/<int:id>', methods=['POST', 'GET'])
 def add_stay(itinerary_id, id):
-    itinerary = load_itinerary(itinerary_id)
+    itinerary = load_for_edit(itinerary_id)
     route = itinerary.get_item(id)
     new_stay = events.Stay(
         sites.Site(
@@ -119,8 +475,8 @@ def add_stay(itinerary_id, id):
         datetime.now(),
         datetime.now(),
     )
-    itinerary.add_stay(new_stay)
-    dump_itinerary(itinerary)
+    touched = itinerary.add_stay(new_stay)
+    dump_itinerary(itinerary, [new_stay, *touched])
     return redirect(
         url_for(
             'edit_stay',
@@ -130,10 +486,137 @@ def add_stay(itinerary_id, id):
     )
 
 
+@app.route('/api/itinerary/<int:itinerary_id>/batch', methods=['POST'])
+def batch(itinerary_id):
+    # Applies a list of operations with one load and one save, e.g.
+    # {"version": 3, "operations": [
+    #     {"op": "add_stay", "fields": {"location": 12, "name": "Camp"}},
+    #     {"op": "edit", "id": 1234567, "fields": {"note": "..."}},
+    #     {"op": "remove_stay", "id": 7654321},
+    #     {"op": "rename", "name": "New name"}]}
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict) or not isinstance(
+        body.get('operations'), list,
+    ):
+        return {'error': 'Expected an object with a list of operations'}, 400
+    itinerary = load_for_edit(itinerary_id)
+    if body.get('version', itinerary.version) != itinerary.version:
+        raise VersionConflict(itinerary_id, body['version'], itinerary.version)
+    try:
+        changed, results = apply_batch(itinerary, body['operations'])
+    except BatchError as exc:
+        return {'error': str(exc), 'index': exc.index}, 400
+    if body['operations']:
+        dump_itinerary(itinerary, changed)
+    return {
+        'id': itinerary.id,
+        'version': itinerary.version,
+        'results': results,
+    }
+
+
+@app.route('/schedule/<int:itinerary_id>', methods=['POST'])
+def schedule(itinerary_id):
+    from .logic.schedule import PaceModel, reschedule
+    itinerary = load_for_edit(itinerary_id)
+    changed = reschedule(itinerary, PaceModel.from_config(get_cfg()))
+    if changed:
+        save_itinerary(itinerary, changed)
+    return redirect(url_for('overview', itinerary_id=itinerary.id))
+
+
+@app.route('/track/<int:itinerary_id>', methods=['POST', 'GET'])
+def track(itinerary_id):
+    from . import tracks
+    if request.method == 'POST':
+        itinerary = load_for_edit(itinerary_id)
+    else:
+        itinerary = load_itinerary(itinerary_id)
+    path = tracks.track_path(get_data_dir(), itinerary_id)
+    error = None
+    if request.method == 'POST' and request.files.get('gpx'):
+        try:
+            imported = tracks.import_gpx(
+                request.files['gpx'].stream,
+                path,
+                get_cfg().get('track_tolerance', tracks.DEFAULT_TOLERANCE),
+            )
+        except tracks.TrackError as exc:
+            error = str(exc)
+        else:
+            dump_itinerary(itinerary, tracks.snap(itinerary, imported))
+            return redirect(url_for('overview', itinerary_id=itinerary.id))
+    return render_template(
+        'track.html',
+        itinerary=itinerary,
+        track=tracks.load_track(path),
+        error=error,
+    ), 400 if error else 200
+
+
+@app.route('/api/itinerary/<int:itinerary_id>/plan', methods=['POST'])
+def plan(itinerary_id):
+    # {"candidates": [{"location": 12.5, "elevation": 4200, "name": "Lake",
+    #                  "has_water": true, "needs_permit": false}, ...],
+    #  "max_distance": 15, "max_gain": 3000, "require_water": true,
+    #  "avoid_permits": true, "nights": null, "apply": false}
+    # With "apply", the planned stays replace the itinerary's current ones.
+    from .logic import planner
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict):
+        return {'error': 'Expected a JSON object'}, 400
+    if body.get('apply'):
+        itinerary = load_for_edit(itinerary_id)
+    else:
+        itinerary = load_itinerary(itinerary_id)
+    try:
+        candidates = [
+            planner.Candidate(**candidate)
+            for candidate in body.get('candidates', [])
+        ]
+        stays = planner.plan(
+            candidates,
+            planner.trailhead_candidate(itinerary.starttrailhead_event),
+            planner.trailhead_candidate(itinerary.endtrailhead_event),
+            planner.Constraints(
+                body['max_distance'],
+                body.get('max_gain'),
+                body.get('require_water', False),
+                body.get('avoid_permits', False),
+            ),
+            body.get('nights'),
+        )
+    except KeyError as exc:
+        return {'error': f'Missing {exc}'}, 400
+    except (TypeError, ValueError) as exc:
+        return {'error': str(exc)}, 400
+    if body.get('apply'):
+        changed = []
+        for stay in itinerary.stays:
+            changed += [stay, *itinerary.remove_stay(stay)]
+        for stay in planner.make_stays(
+            stays,
+            itinerary.starttrailhead_event.datetime,
+        ):
+            changed += [stay, *itinerary.add_stay(stay)]
+        dump_itinerary(itinerary, changed)
+    return {
+        'nights': len(stays),
+        'stays': [stay._asdict() for stay in stays],
+        'version': itinerary.version,
+    }
+
+
 @app.route('/delete/itinerary/<int:itinerary_id>', methods=['POST'])
 def delete_itinerary(itinerary_id):
-    path = Path(get_data_dir()).absolute() / f'{itinerary_id}.pkl'
-    path.unlink()
+    from . import tracks
+    get_storage().delete(itinerary_id)
+    metrics.STORAGE_OPERATIONS.inc(operation='delete')
+    tracks.delete_track(tracks.track_path(get_data_dir(), itinerary_id))
+    cache.discard(itinerary_id)
+    get_catalog().remove(itinerary_id)
+    get_search_index().remove(itinerary_id)
+    artifacts.delete(get_data_dir(), itinerary_id)
     return redirect(url_for('load'))
 
 
@@ -144,10 +627,10 @@ def delete(itinerary_id, id):
 
 @app.route('/delete/stay/<int:itinerary_id>/<int:id>', methods=['POST', 'GET'])
 def delete_stay(itinerary_id, id):
-    itinerary = load_itinerary(itinerary_id)
+    itinerary = load_for_edit(itinerary_id)
     item = itinerary.get_item(id)
-    itinerary.remove_stay(item)
-    dump_itinerary(itinerary)
+    touched = itinerary.remove_stay(item)
+    dump_itinerary(itinerary, [item, *touched])
     return redirect(url_for('overview', itinerary_id=itinerary_id))
 
 
@@ -180,17 +663,17 @@ def edit(itinerary_id, id):
 
 @app.route('/edit/route/<int:itinerary_id>/<int:id>', methods=['POST', 'GET'])
 def edit_route(itinerary_id, id):
-    itinerary = load_itinerary(itinerary_id)
+    if request.method == 'POST':
+        itinerary = load_for_edit(itinerary_id)
+    else:
+        itinerary = load_itinerary(itinerary_id)
     route = itinerary.get_item(id)
     if request.method == 'POST':
-        if 'has_water' in request.form:
-            if not route.has_water:
-                route.add_water()
-        else:
-            route.remove_water()
-        route.name = request.form['name']
-        route.note = request.form['note']
-        dump_itinerary(itinerary)
+        edit_itinerary(itinerary, route.id, {
+            'has_water': 'has_water' in request.form,
+            'name': request.form['name'],
+            'note': request.form['note'],
+        })
         return redirect(url_for('overview', itinerary_id=itinerary.id))
     return render_template(
         'edit_route.html',
@@ -204,27 +687,27 @@ def edit_route(itinerary_id, id):
     methods=['POST', 'GET'],
 )
 def edit_stay(itinerary_id, id):
-    itinerary = load_itinerary(itinerary_id)
+    if request.method == 'POST':
+        itinerary = load_for_edit(itinerary_id)
+    else:
+        itinerary = load_itinerary(itinerary_id)
     stay = itinerary.get_item(id)
     if request.method == 'POST':
-        if 'has_water' in request.form:
-            if not stay.site.has_water:
-                stay.site.add_water()
-        else:
-            stay.site.remove_water()
-        if 'needs_permit' in request.form:
-            stay.needs_permit = True
-        else:
-            stay.needs_permit = False
-        stay.site.name = request.form['name']
-        if parse(request.form['arrive_time']) is not None:
-            stay.event1.datetime = parse(request.form['arrive_time'])
-        if parse(request.form['depart_time']) is not None:
-            stay.event2.datetime = parse(request.form['depart_time'])
-        stay.site.location = int(float(request.form['location']))
-        stay.site.elevation = int(float(request.form['elevation']))
-        stay.note = request.form['note']
-        dump_itinerary(itinerary)
+        fields = {
+            'has_water': 'has_water' in request.form,
+            'needs_permit': 'needs_permit' in request.form,
+            'name': request.form['name'],
+            'location': int(float(request.form['location'])),
+            'elevation': int(float(request.form['elevation'])),
+            'note': request.form['note'],
+        }
+        arrive = parse_datetime(request.form['arrive_time'])
+        if arrive is not None:
+            fields['arrive_datetime'] = arrive
+        depart = parse_datetime(request.form['depart_time'])
+        if depart is not None:
+            fields['depart_datetime'] = depart
+        edit_itinerary(itinerary, stay.id, fields)
         return redirect(url_for('overview', itinerary_id=itinerary.id))
     return render_template(
         'edit_stay.html',
@@ -238,21 +721,23 @@ def edit_stay(itinerary_id, id):
     methods=['POST', 'GET'],
 )
 def edit_trailhead(itinerary_id, id):
-    itinerary = load_itinerary(itinerary_id)
+    if request.method == 'POST':
+        itinerary = load_for_edit(itinerary_id)
+    else:
+        itinerary = load_itinerary(itinerary_id)
     trailhead = itinerary.get_item(id)
     if request.method == 'POST':
-        if 'has_water' in request.form:
-            if not trailhead.site.has_water:
-                trailhead.site.add_water()
-        else:
-            trailhead.site.remove_water()
-        if parse(request.form['arrive_time']) is not None:
-            trailhead.datetime = parse(request.form['arrive_time'])
-        trailhead.site.name = request.form['name']
-        trailhead.site.location = int(float(request.form['location']))
-        trailhead.site.elevation = int(float(request.form['elevation']))
-        trailhead.note = request.form['note']
-        dump_itinerary(itinerary)
+        fields = {
+            'has_water': 'has_water' in request.form,
+            'name': request.form['name'],
+            'location': int(float(request.form['location'])),
+            'elevation': int(float(request.form['elevation'])),
+            'note': request.form['note'],
+        }
+        arrive = parse_datetime(request.form['arrive_time'])
+        if arrive is not None:
+            fields['datetime'] = arrive
+        edit_itinerary(itinerary, trailhead.id, fields)
         return redirect(url_for('overview', itinerary_id=itinerary.id))
     return render_template(
         'edit_trailhead.html',
@@ -266,13 +751,15 @@ def edit_trailhead(itinerary_id, id):
     methods=['POST', 'GET'],
 )
 def edit_title(itinerary_id):
-    itinerary = load_itinerary(itinerary_id)
+    if request.method == 'POST':
+        itinerary = load_for_edit(itinerary_id)
+    else:
+        itinerary = load_itinerary(itinerary_id)
     if request.method == 'POST':
         if not request.form.keys():
             pass
         else:
-            itinerary.name = request.form['name']
-            dump_itinerary(itinerary)
+            edit_itinerary(itinerary, None, {'name': request.form['name']})
             return redirect(url_for('overview', itinerary_id=itinerary.id))
     return render_template(
         'edit_title.html',
@@ -304,10 +791,97 @@ def new():
 
 @app.route('/export/<int:itinerary_id>', methods=['POST', 'GET'])
 def export(itinerary_id):
-    itinerary = load_itinerary(itinerary_id)
-    result = ''
-    for item in itinerary.traverse():
-        for line in item.entrylines():
-            result += line+'\n'
-        result += '\n'
-    return render_template('export.html', result=result)
+    from . import exports
+
+    def render():
+        built = current_artifacts(itinerary_id)
+        if built is None:
+            itinerary = load_itinerary(itinerary_id)
+            result = exports.FORMATS['text'](itinerary)
+        else:
+            itinerary, result = built, [built.text]
+        return stream_template(
+            'export.html',
+            itinerary=itinerary,
+            result=result,
+            formats=exports.FORMATS,
+        )
+
+    return conditional(
+        itinerary_etag('export', itinerary_id),
+        render,
+        get_storage().mtime(itinerary_id),
+    )
+
+
+@app.route('/export/<int:itinerary_id>/<fmt>', methods=['POST', 'GET'])
+def export_as(itinerary_id, fmt):
+    from . import exports
+    if fmt not in exports.FORMATS:
+        return NotFound()
+    fmt = exports.FORMATS[fmt]
+
+    def render():
+        built = fmt.name == 'text' and current_artifacts(itinerary_id)
+        itinerary = built or load_itinerary(itinerary_id)
+        return Response(
+            built.text if built else fmt(itinerary),
+            mimetype=fmt.mimetype,
+            headers={
+                'Content-Disposition': (
+                    'attachment; '
+                    f'filename="{exports.filename(itinerary, fmt)}"'
+                ),
+            },
+        )
+
+    return conditional(
+        itinerary_etag('export', itinerary_id, fmt.name),
+        render,
+        get_storage().mtime(itinerary_id),
+    )
+
+
+@app.route('/stats/<int:itinerary_id>', methods=['GET'])
+def trip_stats(itinerary_id):
+    from .logic import stats
+
+    def render():
+        built = current_artifacts(itinerary_id)
+        if built is not None:
+            return built.stats
+        return stats.trip_stats(load_itinerary(itinerary_id))
+
+    return conditional(
+        itinerary_etag('stats', itinerary_id),
+        render,
+        get_storage().mtime(itinerary_id),
+    )
+
+
+@app.route('/export/all', methods=['POST', 'GET'])
+def export_all():
+    from . import exports
+    fmt = exports.FORMATS.get(request.args.get('format', 'text'))
+    if fmt is None:
+        return NotFound()
+    storage = get_storage()
+
+    def members():
+        # Straight from storage rather than load_itinerary, so a bulk
+        # export neither fills nor evicts the itinerary cache.
+        for itinerary_id in storage.ids():
+            try:
+                itinerary = storage.load(itinerary_id)
+            except ItineraryNotFound:
+                continue
+            name = f'{itinerary.id}-{exports.filename(itinerary, fmt)}'
+            yield name, fmt(itinerary)
+
+    return Response(
+        exports.stream_zip(members()),
+        mimetype='application/zip',
+        headers={
+            'Content-Disposition': f'attachment; filename="{app_name}.zip"',
+        },
+    )
@@ -1,7 +1,77 @@
-from . import app
+import argparse
 
-print('+-------------------------------------------------+')
-print('|                    Welcome!                     |')
-print('| Visit http://127.0.0.1:5000/new to get started. |')
-print('+-------------------------------------------------+')
-app.run()
+from . import (
+    app,
+    get_cfg,
+    get_storage,
+    rebuild_catalog,
+    rebuild_search_index,
+)
+from .storage import FileStorage, SQLiteStorage, migrate
+
+parser = argparse.ArgumentParser(prog='hiker')
+parser.add_argument(
+    '--profile-startup',
+    action='store_true',
+    help='report import and initialization times, then exit',
+)
+subparsers = parser.add_subparsers(dest='command')
+subparsers.add_parser(
+    'migrate',
+    help='import the itinerary files in the data dir into the SQLite store',
+)
+serve = subparsers.add_parser(
+    'serve',
+    help='serve with gunicorn worker processes, as set in config.yaml',
+)
+serve.add_argument('--bind', help='address to listen on, like 0.0.0.0:8000')
+serve.add_argument('--workers', type=int, help='worker processes')
+serve.add_argument('--threads', type=int, help='threads per worker')
+serve.add_argument(
+    '--preload',
+    action=argparse.BooleanOptionalAction,
+    help='load the app once, before forking the workers',
+)
+subparsers.add_parser(
+    'reload',
+    help='gracefully restart the workers of a running server',
+)
+args = parser.parse_args()
+
+if args.profile_startup:
+    from .profiling import profile_startup
+    profile_startup()
+elif args.command == 'migrate':
+    cfg = get_cfg()
+    source = FileStorage(cfg['data_dir'])
+    target = get_storage()
+    if not isinstance(target, SQLiteStorage):
+        target = SQLiteStorage(
+            cfg.get('sqlite_path', source.data_dir / 'hiker.sqlite'),
+        )
+    copied, skipped = migrate(source, target)
+    print(f'Migrated {copied} itineraries to {target.path}')
+    if skipped:
+        print(f'Skipped {skipped} already in the SQLite store')
+    if target is get_storage():
+        rebuild_catalog()
+        rebuild_search_index()
+    else:
+        print("Set 'storage: sqlite' in config.yaml to use them.")
+elif args.command == 'serve':
+    from .server import serve
+    serve({
+        'bind': args.bind,
+        'workers': args.workers,
+        'threads': args.threads,
+        'preload': args.preload,
+    })
+elif args.command == 'reload':
+    from .server import reload
+    print(f'Sent SIGHUP to {reload()}')
+else:
+    print('+-------------------------------------------------+')
+    print('|                    Welcome!                     |')
+    print('| Visit http://127.0.0.1:5000/new to get started. |')
+    print('+-------------------------------------------------+')
+    app.run()
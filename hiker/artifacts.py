@@ -0,0 +1,174 @@
+import json
+import logging
+import os
+from collections import namedtuple
+from pathlib import Path
+from threading import Lock
+
+from .locking import file_lock
+
+logger = logging.getLogger(__name__)
+
+# Off unless artifact_workers is set in config.yaml; see ArtifactQueue.
+DEFAULT_WORKERS = 0
+
+# What is derived from an itinerary in the background after each save:
+# its catalog entry, its trip stats and its text export. stamp is the
+# storage stamp they were built from; they are only served while it is
+# still current.
+Artifacts = namedtuple(
+    'Artifacts',
+    ('id', 'name', 'stamp', 'catalog', 'stats', 'text'),
+)
+
+
+def artifact_path(data_dir, itinerary_id):
+    return Path(data_dir) / f'{itinerary_id}.artifacts.json'
+
+
+def _plain(stamp):
+    # As it comes back from JSON.
+    return list(stamp) if isinstance(stamp, tuple) else stamp
+
+
+def load(data_dir, itinerary_id, stamp):
+    try:
+        with open(artifact_path(data_dir, itinerary_id)) as fh:
+            record = json.load(fh)
+    except (FileNotFoundError, ValueError):
+        return None
+    if record['stamp'] != _plain(stamp):
+        return None
+    return Artifacts(**record)
+
+
+def delete(data_dir, itinerary_id):
+    artifact_path(data_dir, itinerary_id).unlink(missing_ok=True)
+
+
+def _write(path, artifacts):
+    tmp = path.with_name(f'{path.name}.{os.getpid()}.tmp')
+    with open(tmp, 'w') as fh:
+        json.dump(artifacts._asdict(), fh)
+    os.replace(tmp, path)
+
+
+# Each process of the pool keeps its storages and catalogs, as the app does.
+_storages = {}
+_catalogs = {}
+
+
+def build(cfg, itinerary_id):
+    # Runs in the pool. Loads the latest saved version itself, so a job
+    # that waited in the queue still builds from every edit before it.
+    from .catalog import Catalog, catalog_path, summarize
+    from .exports import write_text
+    from .logic.stats import trip_stats
+    from .storage import ItineraryNotFound, open_storage
+
+    key = (
+        cfg.get('storage', 'pickle'),
+        cfg['data_dir'],
+        cfg.get('sqlite_path'),
+    )
+    if key not in _storages:
+        _storages[key] = open_storage(cfg)
+    storage = _storages[key]
+    data_dir = Path(cfg['data_dir'])
+    path = artifact_path(data_dir, itinerary_id)
+    try:
+        stamp = storage.stamp(itinerary_id)
+        current = load(data_dir, itinerary_id, stamp)
+        if current is not None:
+            return current
+        itinerary = storage.load(itinerary_id)
+        mtime = storage.mtime(itinerary_id)
+    except ItineraryNotFound:
+        return None
+    catalog = summarize(itinerary, mtime)
+    artifacts = Artifacts(
+        itinerary.id,
+        itinerary.name,
+        _plain(stamp),
+        catalog,
+        trip_stats(itinerary),
+        ''.join(write_text(itinerary)),
+    )
+    # A job that started earlier can finish later; whichever comes second
+    # finds the stamp moved on and leaves the newer results alone.
+    lock_dir = data_dir / '.locks'
+    lock_dir.mkdir(exist_ok=True)
+    with file_lock(lock_dir / f'{itinerary_id}.artifacts.lock'):
+        try:
+            if storage.stamp(itinerary_id) != stamp:
+                return None
+        except ItineraryNotFound:
+            return None
+        _write(path, artifacts)
+        if data_dir not in _catalogs:
+            _catalogs[data_dir] = Catalog(catalog_path(data_dir))
+        _catalogs[data_dir].update_entry(catalog)
+    return artifacts
+
+
+class ArtifactQueue:
+
+    # A process pool, started on first use, with at most one job per
+    # itinerary waiting in it: as a job loads whatever is saved when it
+    # starts, a burst of edits needs only one.
+    #
+    # The pool's processes are spawned rather than forked, as the app's
+    # processes run threads. Like any spawned process they import the main
+    # module, so a script that saves itineraries needs the usual
+    # `if __name__ == '__main__':` guard.
+
+    def __init__(self):
+        self._pool = None
+        self._queued = {}
+        self._lock = Lock()
+
+    def pool(self, workers):
+        if self._pool is None:
+            import multiprocessing
+            from concurrent.futures import ProcessPoolExecutor
+            self._pool = ProcessPoolExecutor(
+                workers,
+                mp_context=multiprocessing.get_context('spawn'),
+            )
+        return self._pool
+
+    def submit(self, cfg, itinerary_id):
+        from concurrent.futures.process import BrokenProcessPool
+        workers = cfg.get('artifact_workers', DEFAULT_WORKERS)
+        key = (cfg['data_dir'], itinerary_id)
+        with self._lock:
+            future = self._queued.get(key)
+            if future is not None and not (
+                future.running() or future.done()
+            ):
+                return future
+            try:
+                future = self.pool(workers).submit(build, cfg, itinerary_id)
+            except BrokenProcessPool:
+                # One of its processes died, so the pool takes no more work.
+                self._pool = None
+                future = self.pool(workers).submit(build, cfg, itinerary_id)
+            self._queued[key] = future
+        future.add_done_callback(lambda done: self._finish(key, done))
+        return future
+
+    def _finish(self, key, future):
+        with self._lock:
+            if self._queued.get(key) is future:
+                del self._queued[key]
+        if not future.cancelled() and future.exception() is not None:
+            logger.error(
+                'Could not build artifacts for %s',
+                key[1],
+                exc_info=future.exception(),
+            )
+
+    def shutdown(self, wait=True):
+        if self._pool is not None:
+            self._pool.shutdown(wait)
+            self._pool = None
@@ -0,0 +1,66 @@
+from collections import OrderedDict
+from threading import Lock
+
+
+class ItineraryCache:
+
+    def __init__(self, maxsize=32):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, itinerary_id):
+        return itinerary_id in self._entries
+
+    def get(self, itinerary_id, stamp):
+        with self._lock:
+            entry = self._entries.get(itinerary_id)
+            if entry is None or entry[0] != stamp:
+                self._entries.pop(itinerary_id, None)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(itinerary_id)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, itinerary_id, stamp, itinerary):
+        with self._lock:
+            if self.maxsize <= 0:
+                return
+            self._entries[itinerary_id] = (stamp, itinerary)
+            self._entries.move_to_end(itinerary_id)
+            self._evict()
+
+    def discard(self, itinerary_id):
+        with self._lock:
+            self._entries.pop(itinerary_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def resize(self, maxsize):
+        with self._lock:
+            self.maxsize = maxsize
+            self._evict()
+
+    @property
+    def stats(self):
+        return {
+            'size': len(self._entries),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
+
+    def _evict(self):
+        while len(self._entries) > max(self.maxsize, 0):
+            self._entries.popitem(last=False)
+            self.evictions += 1
@@ -0,0 +1,87 @@
+from collections import namedtuple
+from functools import lru_cache
+
+from flask import render_template
+from markupsafe import Markup
+
+from .logic import sites, events
+
+DATETIME_FORMAT = '%A, %B %e %Y at %I:%M %p'
+FRAGMENT_CACHE_SIZE = 4096
+
+
+# rows holds (label, text) pairs, already formatted for display.
+Card = namedtuple('Card', ('kind', 'id', 'name', 'padx', 'rows'))
+
+
+def yes_no(value):
+    return 'yes' if value else 'no'
+
+
+def next_water(water, location):
+    found = water.next_water(location)
+    return 'none ahead' if found is None else f'{found:g}'
+
+
+def route_card(route, water):
+    return Card('route', route.id, route.name, route.padx, (
+        ('Length', str(route.length)),
+        ('Elevation change', str(route.elevation_change)),
+        ('Has water', yes_no(route.has_water)),
+        ('Notes', route.note),
+    ))
+
+
+def stay_card(stay, water):
+    return Card('stay', stay.id, stay.name, stay.padx, (
+        ('Location', str(stay.site.location)),
+        ('Elevation', str(stay.site.elevation)),
+        ('Arrive', stay.arrive_datetime.strftime(DATETIME_FORMAT)),
+        ('Depart', stay.depart_datetime.strftime(DATETIME_FORMAT)),
+        ('Has water', yes_no(stay.site.has_water)),
+        ('Next water at', next_water(water, stay.site.location)),
+        ('Needs permit', yes_no(stay.needs_permit)),
+        ('Notes', stay.note),
+    ))
+
+
+def trailhead_card(event, water):
+    return Card('trailhead', event.id, event.name, event.padx, (
+        ('Location', str(event.site.location)),
+        ('Elevation', str(event.site.elevation)),
+        ('Arrive', event.datetime.strftime(DATETIME_FORMAT)),
+        ('Has water', yes_no(event.site.has_water)),
+        ('Next water at', next_water(water, event.site.location)),
+        ('Notes', event.note),
+    ))
+
+
+CARD_BUILDERS = {
+    sites.Route: route_card,
+    events.Stay: stay_card,
+    events.StartTrailheadEvent: trailhead_card,
+    events.EndTrailheadEvent: trailhead_card,
+}
+
+
+def cards(itinerary):
+    water = itinerary.water_index()
+    return [
+        CARD_BUILDERS[type(item)](item, water)
+        for item in itinerary.traverse()
+    ]
+
+
+@lru_cache(maxsize=FRAGMENT_CACHE_SIZE)
+def render_card(itinerary_id, card):
+    # A card holds everything its fragment shows, so an edit changes the key
+    # of exactly the cards it touched and the rest are served from here.
+    return Markup(render_template(
+        'card.html',
+        itinerary_id=itinerary_id,
+        card=card,
+    ))
+
+
+def render_cards(itinerary):
+    return [render_card(itinerary.id, card) for card in cards(itinerary)]
@@ -0,0 +1,141 @@
+from pathlib import Path
+
+from .database import Database
+
+
+SORT_KEYS = ('name', 'mtime', 'start', 'distance', 'stays')
+COLUMNS = ('id', 'name', 'mtime', 'stays', 'distance', 'start')
+
+# One row per itinerary, written on its own when that itinerary is saved, so
+# a save costs the same however many trips there are. changes counts the
+# writes that altered a row, to tag pages of the listing with.
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS entries (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    mtime REAL NOT NULL,
+    stays INTEGER NOT NULL,
+    distance REAL NOT NULL,
+    start TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS entries_name ON entries (name, id);
+CREATE INDEX IF NOT EXISTS entries_mtime ON entries (mtime, id);
+CREATE INDEX IF NOT EXISTS entries_start ON entries (start, id);
+CREATE INDEX IF NOT EXISTS entries_distance ON entries (distance, id);
+CREATE INDEX IF NOT EXISTS entries_stays ON entries (stays, id);
+CREATE TABLE IF NOT EXISTS changes (count INTEGER NOT NULL);
+INSERT INTO changes SELECT 0 WHERE NOT EXISTS (SELECT 1 FROM changes);
+'''
+
+UPSERT_ENTRY = (
+    f'INSERT INTO entries ({", ".join(COLUMNS)}) '
+    f'VALUES ({", ".join("?" * len(COLUMNS))}) '
+    'ON CONFLICT (id) DO UPDATE SET name = excluded.name, '
+    'mtime = excluded.mtime, stays = excluded.stays, '
+    'distance = excluded.distance, start = excluded.start '
+    'WHERE (name, mtime, stays, distance, start) IS NOT (excluded.name, '
+    'excluded.mtime, excluded.stays, excluded.distance, excluded.start)'
+)
+
+
+def catalog_path(data_dir):
+    return Path(data_dir) / 'catalog.sqlite'
+
+
+def summarize(itinerary, mtime):
+    return {
+        'id': itinerary.id,
+        'name': itinerary.name,
+        'mtime': mtime,
+        'stays': len(itinerary.stays),
+        'distance': sum(route.length for route in itinerary.routes),
+        'start': itinerary.starttrailhead_event.datetime.isoformat(),
+    }
+
+
+class Catalog(Database):
+
+    schema = SCHEMA
+
+    def __contains__(self, itinerary_id):
+        return self.connection.execute(
+            'SELECT 1 FROM entries WHERE id = ?',
+            (itinerary_id,),
+        ).fetchone() is not None
+
+    def __len__(self):
+        return self.connection.execute(
+            'SELECT count(*) FROM entries',
+        ).fetchone()[0]
+
+    def ids(self):
+        return [
+            row[0] for row in self.connection.execute('SELECT id FROM entries')
+        ]
+
+    def entries(self):
+        return {
+            row[0]: dict(zip(COLUMNS, row))
+            for row in self.connection.execute(
+                f'SELECT {", ".join(COLUMNS)} FROM entries',
+            )
+        }
+
+    def update(self, itinerary, mtime):
+        self.update_entry(summarize(itinerary, mtime))
+
+    def update_entry(self, entry):
+        with self.transaction() as conn:
+            if conn.execute(
+                UPSERT_ENTRY,
+                [entry[column] for column in COLUMNS],
+            ).rowcount:
+                self._changed(conn)
+
+    def remove(self, itinerary_id):
+        with self.transaction() as conn:
+            if conn.execute(
+                'DELETE FROM entries WHERE id = ?',
+                (itinerary_id,),
+            ).rowcount:
+                self._changed(conn)
+
+    def rebuild(self, itineraries):
+        rows = [
+            [entry[column] for column in COLUMNS]
+            for entry in (
+                summarize(itinerary, mtime)
+                for itinerary, mtime in itineraries
+            )
+        ]
+        with self.transaction() as conn:
+            conn.execute('DELETE FROM entries')
+            conn.executemany(UPSERT_ENTRY, rows)
+            self._changed(conn)
+
+    def _changed(self, conn):
+        conn.execute('UPDATE changes SET count = count + 1')
+
+    def stamp(self):
+        return self.connection.execute(
+            'SELECT count FROM changes',
+        ).fetchone()[0]
+
+    def in_sync(self, itinerary_ids):
+        return set(itinerary_ids) == set(self.ids())
+
+    def page(self, sort='mtime', reverse=True, page=1, per_page=50):
+        if sort not in SORT_KEYS:
+            raise ValueError(f'Cannot sort by {sort}')
+        order = 'DESC' if reverse else 'ASC'
+        with self.snapshot() as conn:
+            entries = [
+                dict(zip(COLUMNS, row))
+                for row in conn.execute(
+                    f'SELECT {", ".join(COLUMNS)} FROM entries '
+                    f'ORDER BY {sort} {order}, id {order} LIMIT ? OFFSET ?',
+                    (per_page, (page - 1) * per_page),
+                )
+            ]
+            total = conn.execute('SELECT count(*) FROM entries').fetchone()[0]
+        return entries, total
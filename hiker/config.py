@@ -0,0 +1,64 @@
+import time
+from pathlib import Path
+
+from .info import app_name
+
+# How often, at most, to stat config.yaml for changes.
+CHECK_INTERVAL = 1.0
+
+
+def config_path():
+    from appdirs import user_config_dir
+    return Path(user_config_dir()) / app_name / 'config.yaml'
+
+
+def make_default_cfg(file):
+    import yaml
+    from appdirs import user_data_dir
+    data_dir = Path(user_data_dir()) / app_name
+    if not data_dir.exists():
+        data_dir.mkdir()
+    cfg = {
+        'data_dir': str(data_dir.absolute()),
+    }
+    with open(file, 'w') as fh:
+        yaml.dump(cfg, fh)
+    return Path(file).exists()
+
+
+class Config:
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.reloads = 0
+        self._cfg = None
+        self._mtime = None
+        self._checked = 0
+
+    def load(self):
+        import yaml
+        if not self.path.exists():
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            if not make_default_cfg(self.path):
+                raise IOError('Could not create config file')
+        mtime = self.path.stat().st_mtime_ns
+        with open(self.path, 'r') as fh:
+            self._cfg = yaml.safe_load(fh)
+        self._mtime = mtime
+        self.reloads += 1
+        return self._cfg
+
+    def get(self):
+        now = time.monotonic()
+        if self._cfg is None:
+            self._checked = now
+            return self.load()
+        if now - self._checked >= CHECK_INTERVAL:
+            self._checked = now
+            try:
+                mtime = self.path.stat().st_mtime_ns
+            except FileNotFoundError:
+                mtime = None
+            if mtime != self._mtime:
+                return self.load()
+        return self._cfg
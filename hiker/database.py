@@ -0,0 +1,72 @@
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from pathlib import Path
+
+# Datetimes are stored, and handed to NumPy, as whole seconds since this.
+EPOCH = datetime(1970, 1, 1)
+SECOND = timedelta(seconds=1)
+
+
+def timestamp(value):
+    return (value - EPOCH) // SECOND
+
+
+def from_timestamp(value):
+    return EPOCH + value * SECOND
+
+
+class Database:
+
+    # A SQLite file shared by worker processes, with a connection per
+    # thread. Subclasses give the tables they need as schema.
+
+    schema = ''
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self._local = threading.local()
+        self.connection.executescript(self.schema)
+
+    @property
+    def connection(self):
+        conn = getattr(self._local, 'connection', None)
+        if conn is None:
+            import sqlite3
+            conn = sqlite3.connect(
+                self.path,
+                timeout=30,
+                isolation_level=None,
+            )
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.connection = conn
+        return conn
+
+    @contextmanager
+    def transaction(self):
+        # BEGIN IMMEDIATE takes the write lock up front, so checks made in
+        # the transaction and the writes that follow them cannot interleave
+        # with another worker's.
+        conn = self.connection
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield conn
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+
+    @contextmanager
+    def snapshot(self):
+        # Reads in one transaction see every table at the same version,
+        # however many writes commit meanwhile.
+        conn = self.connection
+        if conn.in_transaction:
+            yield conn
+            return
+        conn.execute('BEGIN')
+        try:
+            yield conn
+        finally:
+            conn.execute('COMMIT')
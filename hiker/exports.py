@@ -0,0 +1,200 @@
+import csv
+import io
+import json
+import zipfile
+from xml.sax.saxutils import escape
+
+from werkzeug.utils import secure_filename
+
+from .logic import sites, events
+
+
+FORMATS = {}
+
+
+class Format:
+
+    def __init__(self, name, mimetype, extension, write):
+        self.name = name
+        self.mimetype = mimetype
+        self.extension = extension
+        self.write = write
+
+    def __call__(self, itinerary):
+        return self.write(itinerary)
+
+
+def formatter(name, mimetype, extension):
+    def register(write):
+        FORMATS[name] = Format(name, mimetype, extension, write)
+        return write
+    return register
+
+
+def kind(item):
+    if isinstance(item, sites.Route):
+        return 'route'
+    if isinstance(item, events.Stay):
+        return 'stay'
+    if isinstance(item, events.StartTrailheadEvent):
+        return 'start'
+    return 'end'
+
+
+def item_record(item):
+    water = item if isinstance(item, sites.Route) else item.site
+    record = {
+        'kind': kind(item),
+        'id': item.id,
+        'name': item.name,
+        'has_water': water.has_water,
+        'note': item.note,
+    }
+    if isinstance(item, sites.Route):
+        record['start'] = item.site1.location
+        record['end'] = item.site2.location
+        record['distance'] = item.length
+        record['elevation_change'] = item.elevation_change
+    elif isinstance(item, events.Stay):
+        record['location'] = item.site.location
+        record['elevation'] = item.site.elevation
+        record['arrive'] = item.arrive_datetime.isoformat()
+        record['depart'] = item.depart_datetime.isoformat()
+        record['needs_permit'] = item.needs_permit
+    else:
+        record['location'] = item.site.location
+        record['elevation'] = item.site.elevation
+        record['arrive' if kind(item) == 'end' else 'depart'] = (
+            item.datetime.isoformat()
+        )
+    return record
+
+
+def items(itinerary):
+    # Snapshot the traversal up front, so the response streams from a
+    # fixed list whatever happens to the itinerary meanwhile.
+    return list(itinerary.traverse())
+
+
+@formatter('text', 'text/plain', 'txt')
+def write_text(itinerary):
+    from .logic import stats, water
+    snapshot = items(itinerary)
+    summary = stats.summary_lines(stats.trip_stats(itinerary))
+    summary += ['', *water.summary_lines(itinerary.water_index())]
+    for item in snapshot:
+        yield ''.join(line + '\n' for line in item.entrylines()) + '\n'
+    yield ''.join(line + '\n' for line in summary)
+
+
+@formatter('json', 'application/json', 'json')
+def write_json(itinerary):
+    from .logic.stats import trip_stats
+    snapshot = items(itinerary)
+    stats = trip_stats(itinerary)
+    water = itinerary.water_index()
+    gap = water.max_gap()
+    yield json.dumps({'id': itinerary.id, 'name': itinerary.name})[:-1]
+    yield ', "items": ['
+    for i, item in enumerate(snapshot):
+        yield (', ' if i else '') + json.dumps(item_record(item))
+    yield '], "stats": ' + json.dumps(stats)
+    yield ', "water": ' + json.dumps({
+        'sources': water.locations(),
+        'longest_gap': None if gap is None else list(gap),
+    }) + '}\n'
+
+
+CSV_COLUMNS = (
+    'kind',
+    'id',
+    'name',
+    'location',
+    'elevation',
+    'start',
+    'end',
+    'distance',
+    'elevation_change',
+    'arrive',
+    'depart',
+    'has_water',
+    'needs_permit',
+    'note',
+)
+
+
+@formatter('csv', 'text/csv', 'csv')
+def write_csv(itinerary):
+    buf = io.StringIO()
+    writer = csv.DictWriter(buf, CSV_COLUMNS)
+    writer.writeheader()
+    for item in items(itinerary):
+        writer.writerow(item_record(item))
+        yield buf.getvalue()
+        buf.seek(0)
+        buf.truncate()
+
+
+@formatter('gpx', 'application/gpx+xml', 'gpx')
+def write_gpx(itinerary):
+    # Sites only know their distance along the route, so waypoints carry
+    # it in <desc> and use a placeholder position.
+    yield (
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        '<gpx version="1.1" creator="hiker" '
+        'xmlns="http://www.topografix.com/GPX/1/1">\n'
+        f'<metadata><name>{escape(itinerary.name)}</name></metadata>\n'
+    )
+    for item in items(itinerary):
+        if isinstance(item, sites.Route):
+            continue
+        record = item_record(item)
+        time = record.get('arrive', record.get('depart'))
+        yield (
+            '<wpt lat="0" lon="0">'
+            f'<ele>{record["elevation"]}</ele>'
+            f'<time>{time}</time>'
+            f'<name>{escape(record["name"])}</name>'
+            f'<desc>{escape(str(record["location"]))}</desc>'
+            f'<type>{record["kind"]}</type>'
+            '</wpt>\n'
+        )
+    yield '</gpx>\n'
+
+
+def filename(itinerary, fmt):
+    return f'{secure_filename(itinerary.name) or itinerary.id}.{fmt.extension}'
+
+
+class _Pipe(io.RawIOBase):
+    # An unseekable sink: zipfile then writes data descriptors after each
+    # member and never seeks back, so the archive can be sent as it grows.
+
+    def __init__(self):
+        self.chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks.clear()
+        return data
+
+
+def stream_zip(members):
+    pipe = _Pipe()
+    with zipfile.ZipFile(pipe, 'w', zipfile.ZIP_DEFLATED) as zf:
+        for name, chunks in members:
+            with zf.open(name, 'w', force_zip64=True) as fh:
+                for chunk in chunks:
+                    fh.write(chunk.encode())
+                    data = pipe.drain()
+                    if data:
+                        yield data
+            yield pipe.drain()
+    yield pipe.drain()
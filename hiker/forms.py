@@ -0,0 +1,54 @@
+from datetime import datetime
+from functools import lru_cache
+
+
+# Formats the app itself produces (datetime-local inputs are ISO-8601 and
+# handled by fromisoformat; the rest match the overview and export text).
+DATETIME_FORMATS = (
+    '%A, %B %d %Y at %I:%M %p',
+    '%B %d %Y at %I:%M %p',
+    '%Y-%m-%d %I:%M %p',
+    '%m/%d/%Y %H:%M',
+    '%m/%d/%Y %I:%M %p',
+    '%m/%d/%Y',
+)
+
+
+# Two unlike moments. Free text that reads the same against both names a
+# fixed time and can be memoized; anything else is relative to now.
+PROBES = (
+    datetime(2001, 2, 3, 4, 5, 6),
+    datetime(2012, 11, 20, 17, 41, 33),
+)
+RELATIVE = object()
+
+
+def parse_datetime(value, now=None):
+    value = value.strip()
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        pass
+    for fmt in DATETIME_FORMATS:
+        try:
+            return datetime.strptime(value, fmt)
+        except ValueError:
+            pass
+    parsed = _parse_absolute(value)
+    if parsed is RELATIVE:
+        return _parse_free_text(value, now or datetime.now())
+    return parsed
+
+
+@lru_cache(maxsize=256)
+def _parse_absolute(value):
+    first, second = (_parse_free_text(value, base) for base in PROBES)
+    return first if first == second else RELATIVE
+
+
+def _parse_free_text(value, base):
+    # dateparser is slow to import, so only pay for it on free text.
+    from dateparser import parse
+    return parse(value, settings={'RELATIVE_BASE': base})
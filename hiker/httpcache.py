@@ -0,0 +1,130 @@
+import gzip
+import hashlib
+import zlib
+from functools import lru_cache
+from pathlib import Path
+
+from flask import Response, make_response, request, url_for
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESS_LEVEL = 6
+# Bodies smaller than this are not worth the CPU or the extra headers.
+MIN_COMPRESS_SIZE = 512
+COMPRESSIBLE_TYPES = {
+    'application/gpx+xml',
+    'application/javascript',
+    'application/json',
+}
+# Fingerprinted static URLs never change content, so they can be kept for
+# as long as the browser likes.
+STATIC_MAX_AGE = 365 * 24 * 3600
+
+
+def make_etag(*parts):
+    return hashlib.blake2b(
+        repr(parts).encode(),
+        digest_size=12,
+    ).hexdigest()
+
+
+def conditional(etag, render, last_modified=None):
+    # Answer 304 before render() runs, so an unchanged page costs a stat of
+    # the itinerary and nothing else. The tag is weak because the same page
+    # may be sent gzipped, brotli-compressed or plain.
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+    else:
+        response = make_response(render())
+    response.set_etag(etag, weak=True)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    response.cache_control.no_cache = True
+    return response
+
+
+@lru_cache(maxsize=64)
+def _fingerprint(path, mtime_ns):
+    with open(path, 'rb') as fh:
+        return hashlib.blake2b(fh.read(), digest_size=6).hexdigest()
+
+
+def static_url(static_folder, filename):
+    path = Path(static_folder) / filename
+    return url_for(
+        'static',
+        filename=filename,
+        v=_fingerprint(path, path.stat().st_mtime_ns),
+    )
+
+
+def choose_encoding():
+    accepted = request.accept_encodings
+    if brotli is not None and accepted['br']:
+        return 'br'
+    if accepted['gzip']:
+        return 'gzip'
+    return None
+
+
+def compressible(response):
+    if response.status_code != 200 or 'Content-Encoding' in response.headers:
+        return False
+    mimetype = response.mimetype or ''
+    return mimetype.startswith('text/') or mimetype in COMPRESSIBLE_TYPES
+
+
+def _compress_chunks(chunks, encoding):
+    if encoding == 'br':
+        compressor = brotli.Compressor()
+        for chunk in chunks:
+            data = compressor.process(chunk)
+            if data:
+                yield data
+        yield compressor.finish()
+        return
+    compressor = zlib.compressobj(COMPRESS_LEVEL, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        # Flushing per chunk keeps streamed exports streaming, at the cost
+        # of a few bytes per chunk.
+        data = compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def compress(response):
+    if not compressible(response):
+        return response
+    encoding = choose_encoding()
+    response.vary.add('Accept-Encoding')
+    if encoding is None:
+        return response
+    if response.is_streamed or response.direct_passthrough:
+        chunks = response.iter_encoded()
+        response.direct_passthrough = False
+        response.response = _compress_chunks(chunks, encoding)
+        response.headers.pop('Content-Length', None)
+    else:
+        data = response.get_data()
+        if len(data) < MIN_COMPRESS_SIZE:
+            return response
+        if encoding == 'br':
+            data = brotli.compress(data)
+        else:
+            data = gzip.compress(data, COMPRESS_LEVEL)
+        response.set_data(data)
+    response.headers['Content-Encoding'] = encoding
+    return response
+
+
+def cache_static(response):
+    if request.endpoint == 'static' and 'v' in request.args:
+        response.cache_control.no_cache = None
+        response.cache_control.public = True
+        response.cache_control.max_age = STATIC_MAX_AGE
+        response.cache_control.immutable = True
+    return response
@@ -0,0 +1,71 @@
+import json
+import os
+from datetime import datetime
+from pathlib import Path
+
+
+def _encode(value):
+    if isinstance(value, datetime):
+        return {'$datetime': value.isoformat()}
+    raise TypeError(f'Cannot journal {type(value).__name__}')
+
+
+def _decode(obj):
+    if '$datetime' in obj:
+        return datetime.fromisoformat(obj['$datetime'])
+    return obj
+
+
+class Journal:
+
+    def __init__(self, path):
+        self.path = Path(path)
+
+    def append(self, item_id, fields, version=None):
+        line = json.dumps(
+            {'item': item_id, 'fields': fields, 'version': version},
+            default=_encode,
+        )
+        fd = os.open(self.path, os.O_RDWR | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            size = os.fstat(fd).st_size
+            if size and os.pread(fd, 1, size - 1) != b'\n':
+                # Close off a record torn by a crash so it stays on a line
+                # of its own and is skipped on replay.
+                line = '\n' + line
+            os.write(fd, (line + '\n').encode())
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def records(self):
+        try:
+            data = self.path.read_bytes()
+        except FileNotFoundError:
+            return []
+        records = []
+        # Anything after the last newline is a write torn by a crash.
+        for line in data.split(b'\n')[:-1]:
+            try:
+                record = json.loads(line, object_hook=_decode)
+            except ValueError:
+                continue
+            records.append(
+                (record['item'], record['fields'], record.get('version')),
+            )
+        return records
+
+    def size(self):
+        try:
+            return self.path.stat().st_size
+        except FileNotFoundError:
+            return 0
+
+    def mtime(self):
+        try:
+            return self.path.stat().st_mtime
+        except FileNotFoundError:
+            return 0
+
+    def clear(self):
+        self.path.unlink(missing_ok=True)
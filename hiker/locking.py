@@ -0,0 +1,40 @@
+import os
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+_locks = {}
+_guard = threading.Lock()
+
+
+def named_lock(name):
+    # One lock per name, shared by the threads of this process.
+    with _guard:
+        return _locks.setdefault(name, threading.Lock())
+
+
+@contextmanager
+def file_lock(path):
+    # flock() serializes worker processes; the thread lock covers threads
+    # within one worker and platforms without fcntl.
+    with named_lock(str(path)):
+        with open(path, 'a') as fh:
+            if fcntl is not None:
+                fcntl.flock(fh, fcntl.LOCK_EX)
+            yield
+
+
+def _after_fork():
+    # Locks held by other threads of the parent would never be released in
+    # the child.
+    global _guard
+    _locks.clear()
+    _guard = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork)
@@ -0,0 +1,35 @@
+from functools import cache
+
+
+@cache
+def slot_names(cls):
+    names = []
+    for klass in reversed(cls.__mro__):
+        slots = klass.__dict__.get('__slots__', ())
+        names.extend((slots,) if isinstance(slots, str) else slots)
+    return tuple(names)
+
+
+class Slotted:
+
+    __slots__ = ()
+
+    def __getstate__(self):
+        # Values only, in slot order, to keep attribute names out of every
+        # pickled object.
+        return [getattr(self, name, None) for name in slot_names(type(self))]
+
+    def __setstate__(self, state):
+        if isinstance(state, list):
+            state = dict(zip(slot_names(type(self)), state))
+        elif isinstance(state, tuple):
+            state = {**(state[0] or {}), **(state[1] or {})}
+        # Anything else is the __dict__ of a pickle written before the
+        # model used __slots__.
+        self._restore(state)
+
+    def _restore(self, state):
+        names = slot_names(type(self))
+        for key, value in state.items():
+            if key in names:
+                setattr(self, key, value)
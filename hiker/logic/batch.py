@@ -0,0 +1,108 @@
+from datetime import datetime
+
+from . import sites, events
+from .edits import STAY_FIELDS, apply_edit, check_fields
+
+DATETIME_FIELDS = {'arrive_datetime', 'depart_datetime', 'datetime'}
+STAY_DEFAULTS = {
+    'elevation': 0,
+    'name': '',
+    'note': '',
+    'needs_permit': False,
+    'has_water': False,
+}
+
+
+class BatchError(ValueError):
+
+    def __init__(self, index, message):
+        super().__init__(f'Operation {index}: {message}')
+        self.index = index
+
+
+def decode_fields(fields):
+    # Dates come as ISO strings; anything else of the wrong type is left
+    # for check_fields to reject.
+    if not isinstance(fields, dict):
+        raise ValueError('fields must be an object')
+    return {
+        key: (
+            datetime.fromisoformat(value)
+            if key in DATETIME_FIELDS and isinstance(value, str)
+            else value
+        )
+        for key, value in fields.items()
+    }
+
+
+def add_stay(itinerary, fields):
+    fields = {**STAY_DEFAULTS, **decode_fields(fields)}
+    if 'location' not in fields:
+        raise ValueError('add_stay needs a location')
+    unknown = set(fields) - STAY_FIELDS
+    if unknown:
+        raise ValueError(f'Cannot set {", ".join(sorted(unknown))}')
+    check_fields(fields)
+    now = datetime.now()
+    stay = events.Stay(
+        sites.Site(
+            fields.pop('location'),
+            fields.pop('elevation'),
+            name=fields.pop('name'),
+        ),
+        fields.pop('arrive_datetime', now),
+        fields.pop('depart_datetime', now),
+        note=fields.pop('note'),
+        needs_permit=fields.pop('needs_permit'),
+    )
+    if fields.pop('has_water'):
+        stay.site.add_water()
+    return stay, [stay, *itinerary.add_stay(stay)]
+
+
+def remove_stay(itinerary, item_id):
+    stay = itinerary.get_item(item_id)
+    if not isinstance(stay, events.Stay):
+        raise ValueError(f'{item_id} is not a stay')
+    return [stay, *itinerary.remove_stay(stay)]
+
+
+def apply_batch(itinerary, operations):
+    # Applies every operation to the one in-memory itinerary. Returns the
+    # items to save and one result per operation, and raises BatchError
+    # naming the first operation that could not be applied.
+    changed = {}
+    results = []
+    for index, operation in enumerate(operations):
+        try:
+            if not isinstance(operation, dict):
+                raise ValueError('Operations must be objects')
+            op = operation['op']
+            result = {}
+            if op == 'add_stay':
+                stay, touched = add_stay(itinerary, operation.get('fields', {}))
+                result['id'] = stay.id
+            elif op == 'edit':
+                touched = apply_edit(
+                    itinerary,
+                    operation.get('id'),
+                    decode_fields(operation['fields']),
+                )
+            elif op == 'remove_stay':
+                touched = remove_stay(itinerary, operation['id'])
+            elif op == 'rename':
+                touched = apply_edit(
+                    itinerary,
+                    operation.get('id'),
+                    {'name': operation['name']},
+                )
+            else:
+                raise ValueError(f'Unknown operation {op!r}')
+        except KeyError as exc:
+            raise BatchError(index, f'Missing {exc}') from None
+        except (TypeError, ValueError) as exc:
+            raise BatchError(index, str(exc)) from None
+        for item in touched:
+            changed[id(item)] = item
+        results.append(result)
+    return list(changed.values()), results
@@ -0,0 +1,96 @@
+import math
+from datetime import datetime
+
+from . import sites, events
+
+
+ITINERARY_FIELDS = {'name', 'note'}
+ROUTE_FIELDS = {'name', 'note', 'has_water'}
+STAY_FIELDS = {
+    'name',
+    'note',
+    'has_water',
+    'location',
+    'elevation',
+    'needs_permit',
+    'arrive_datetime',
+    'depart_datetime',
+}
+TRAILHEAD_FIELDS = {
+    'name',
+    'note',
+    'has_water',
+    'location',
+    'elevation',
+    'datetime',
+}
+
+
+# What each field holds, for checking edits that come from outside.
+FIELD_TYPES = {
+    'name': (str, 'a string'),
+    'note': (str, 'a string'),
+    'has_water': (bool, 'true or false'),
+    'needs_permit': (bool, 'true or false'),
+    'location': ((int, float), 'a number'),
+    'elevation': ((int, float), 'a number'),
+    'arrive_datetime': (datetime, 'an ISO date and time'),
+    'depart_datetime': (datetime, 'an ISO date and time'),
+    'datetime': (datetime, 'an ISO date and time'),
+}
+
+
+def check_fields(fields):
+    # Raises ValueError for a value of the wrong type. Models don't check
+    # what they are given, and a bad value would only fail later, when the
+    # itinerary is saved, indexed or rendered.
+    for key, value in fields.items():
+        types, expected = FIELD_TYPES[key]
+        if (
+            not isinstance(value, types)
+            # True and False are ints too.
+            or isinstance(value, bool) is not (types is bool)
+            or isinstance(value, float) and not math.isfinite(value)
+            or isinstance(value, datetime) and value.tzinfo is not None
+        ):
+            raise ValueError(f'{key} must be {expected}')
+
+
+def editable_fields(item):
+    if isinstance(item, sites.Itinerary):
+        return ITINERARY_FIELDS
+    if isinstance(item, sites.Route):
+        return ROUTE_FIELDS
+    if isinstance(item, events.Stay):
+        return STAY_FIELDS
+    return TRAILHEAD_FIELDS
+
+
+def apply_edit(itinerary, item_id, fields):
+    # item_id None addresses the itinerary itself. Edits only ever set
+    # fields, so replaying one twice leaves the itinerary unchanged.
+    if item_id is None:
+        item = itinerary
+    else:
+        item = itinerary.get_item(item_id)
+    unknown = set(fields) - editable_fields(item)
+    if unknown:
+        raise ValueError(f'Cannot edit {", ".join(sorted(unknown))}')
+    check_fields(fields)
+    for key, value in fields.items():
+        if key == 'has_water':
+            water = item if isinstance(item, sites.Route) else item.site
+            if value and not water.has_water:
+                water.add_water()
+            elif not value:
+                water.remove_water()
+        elif key in ('location', 'elevation'):
+            setattr(item.site, key, value)
+        else:
+            setattr(item, key, value)
+    if item is itinerary:
+        return []
+    changed = [item, *itinerary.reorder(item)]
+    if fields.keys() & {'has_water', 'location'}:
+        itinerary.water_changed([item])
+    return changed
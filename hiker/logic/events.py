@@ -1,10 +1,14 @@
 import uuid
 
+from .base import Slotted
+
 def uuid4():
     u = uuid.uuid4().int
     return int(str(u)[:7])
 
-class Event:
+class Event(Slotted):
+
+    __slots__ = ('id',)
 
     def __init__(self):
         self.id = uuid4()
@@ -16,10 +20,13 @@ class Event:
 
 class StartTrailheadEvent(Event):
 
+    __slots__ = ('datetime', 'site', 'note')
+
+    padx = 0
+
     def __init__(self, datetime, starttrailhead, note=''):
         self.datetime = datetime
         self.site = starttrailhead
-        self.padx = 0
         self.note = note
         super().__init__()
 
@@ -50,10 +57,13 @@ class StartTrailheadEvent(Event):
 
 class EndTrailheadEvent(Event):
 
+    __slots__ = ('datetime', 'site', 'note')
+
+    padx = 0
+
     def __init__(self, datetime, endtrailhead, note=''):
         self.datetime = datetime
         self.site = endtrailhead
-        self.padx = 0
         self.note = note
         super().__init__()
 
@@ -84,6 +94,8 @@ class EndTrailheadEvent(Event):
 
 class SiteArriveEvent(Event):
 
+    __slots__ = ('datetime', 'site')
+
     def __init__(self, datetime, site):
         self.datetime = datetime
         self.site = site
@@ -104,6 +116,8 @@ class SiteArriveEvent(Event):
 
 class SiteDepartEvent(Event):
 
+    __slots__ = ('datetime', 'site')
+
     def __init__(self, datetime, site):
         self.datetime = datetime
         self.site = site
@@ -121,13 +135,23 @@ class SiteDepartEvent(Event):
     def info(self):
         return self.site.info
 
-class Stay:
+class Stay(Slotted):
+
+    __slots__ = (
+        'event1',
+        'event2',
+        'site',
+        'id',
+        'note',
+        'needs_permit',
+    )
+
+    padx = 2
 
     def __init__(self, site, arrive_datetime, depart_datetime, note='', needs_permit=False):
         self.event1 = SiteArriveEvent(arrive_datetime, site)
         self.event2 = SiteDepartEvent(depart_datetime, site)
         self.site = site
-        self.padx = 2
         self.id = uuid4()
         self.note = note
         self.needs_permit = needs_permit
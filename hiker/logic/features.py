@@ -1,10 +1,77 @@
+import enum
+
+from .base import Slotted
+
+
+class Features(enum.IntFlag):
+    NONE = 0
+    WATER = 1
+
+
+WATER = int(Features.WATER)
+
+
 class Feature:
 
+    flag = Features.NONE
+
     def __init__(self):
         pass
 
 
 class WaterFeature(Feature):
 
+    flag = Features.WATER
+
     def __init__(self):
         pass
+
+
+def mask(features):
+    # Accepts a flag, a Feature instance or any iterable of them, as older
+    # code and pickles hold lists of Feature instances.
+    if features is None:
+        return 0
+    if isinstance(features, int):
+        return int(features)
+    if isinstance(features, Feature):
+        return int(features.flag)
+    result = 0
+    for feature in features:
+        result |= mask(feature)
+    return result
+
+
+class Featured(Slotted):
+
+    __slots__ = ('_features',)
+
+    def _restore(self, state):
+        if 'features' in state:
+            state = dict(state)
+            state['_features'] = mask(state.pop('features'))
+        super()._restore(state)
+
+    @property
+    def features(self):
+        return Features(self._features)
+
+    @features.setter
+    def features(self, value):
+        self._features = mask(value)
+
+    @property
+    def has_water(self):
+        return bool(self._features & WATER)
+
+    def add_feature(self, feature):
+        self._features |= mask(feature)
+
+    def remove_feature(self, feature):
+        self._features &= ~mask(feature)
+
+    def remove_water(self):
+        self._features &= ~WATER
+
+    def add_water(self):
+        self._features |= WATER
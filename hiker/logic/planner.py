@@ -0,0 +1,164 @@
+from collections import namedtuple
+from datetime import datetime, time, timedelta
+
+import numpy as np
+
+from . import sites, events
+
+# A day's effort in miles: Naismith puts 2000 ft of climb level with three
+# miles on the flat.
+FEET_PER_MILE_OF_EFFORT = 2000 / 3
+ARRIVE_TIME = time(17)
+DEPART_TIME = time(8)
+
+Candidate = namedtuple(
+    'Candidate',
+    ('location', 'elevation', 'name', 'has_water', 'needs_permit'),
+    defaults=('', False, False),
+)
+
+
+class PlanError(ValueError):
+    pass
+
+
+class Constraints:
+
+    def __init__(
+        self,
+        max_distance,
+        max_gain=None,
+        require_water=False,
+        avoid_permits=False,
+    ):
+        if max_distance <= 0:
+            raise ValueError('max_distance must be positive')
+        self.max_distance = max_distance
+        self.max_gain = np.inf if max_gain is None else max_gain
+        self.require_water = require_water
+        self.avoid_permits = avoid_permits
+
+    def allows(self, candidate):
+        return (
+            (candidate.has_water or not self.require_water)
+            and not (candidate.needs_permit and self.avoid_permits)
+        )
+
+
+def plan(candidates, start, end, constraints, nights=None):
+    # Picks stays between the start and end (Candidates, usually the
+    # trailheads) so that no day goes over the distance or climb limits.
+    # With nights=None as few nights as possible are used; either way, the
+    # plan returned is the one whose daily efforts have the smallest sum of
+    # squares, i.e. the most even one.
+    profile = sorted(
+        [c for c in candidates if start.location < c.location < end.location]
+        + [start, end],
+        key=lambda c: c.location,
+    )
+    location = np.array([c.location for c in profile], dtype=float)
+    elevation = np.array([c.elevation for c in profile], dtype=float)
+    # Cumulative climb over every candidate, eligible or not, since they
+    # all describe the terrain.
+    climb = np.concatenate([
+        [0],
+        np.cumsum(np.maximum(np.diff(elevation), 0)),
+    ])
+    eligible = np.array([
+        c is start or c is end or constraints.allows(c) for c in profile
+    ])
+    nodes = [c for c, ok in zip(profile, eligible) if ok]
+    distance = location[eligible]
+    gain = climb[eligible]
+    effort = distance + gain / FEET_PER_MILE_OF_EFFORT
+
+    # First site a day ending at each site may have started from.
+    first = np.maximum(
+        np.searchsorted(distance, distance - constraints.max_distance),
+        np.searchsorted(gain, gain - constraints.max_gain),
+    )
+    last = len(nodes) - 1
+
+    # reach[d] is the furthest site reachable in d days and back[d] the
+    # earliest one the end can be reached from in d days. Greedy works for
+    # both because every window only slides forwards along the trail.
+    reach = [0]
+    while reach[-1] < last:
+        furthest = int(np.searchsorted(first, reach[-1], 'right')) - 1
+        if furthest == reach[-1]:
+            raise PlanError('No plan fits these limits')
+        reach.append(furthest)
+    days = len(reach) - 1
+    if nights is not None:
+        if not days <= nights + 1 <= last:
+            raise PlanError(f'No plan fits in {nights} nights')
+        days = nights + 1
+        reach += [last] * (days + 1 - len(reach))
+    back = [last]
+    for _ in range(days):
+        back.append(int(first[back[-1]]))
+
+    # Layer d of the DP holds the most even way to end day d at each site.
+    # Only sites that can be both reached in d days and left with enough
+    # days to finish are considered, which keeps each layer to a narrow
+    # band; within it, every possible length of day is one vectorized pass.
+    cost = np.full(len(nodes), np.inf)
+    cost[0] = 0
+    steps = []
+    for day in range(1, days + 1):
+        low = max(back[days - day], day)
+        high = min(reach[day], last - (days - day))
+        span = np.arange(low, high + 1)
+        longest = span - first[low:high + 1]
+        best = np.full(len(span), np.inf)
+        step = np.zeros(len(span), dtype=int)
+        for w in range(1, int(longest.max()) + 1):
+            previous = span - w
+            candidate = cost[previous] + (effort[span] - effort[previous]) ** 2
+            candidate[longest < w] = np.inf
+            better = candidate < best
+            best[better] = candidate[better]
+            step[better] = w
+        cost = np.full(len(nodes), np.inf)
+        cost[low:high + 1] = best
+        steps.append((low, step))
+    if not np.isfinite(cost[last]):
+        raise PlanError('No plan fits these limits')
+
+    stays = []
+    node = last
+    for low, step in reversed(steps[1:]):
+        node -= step[node - low]
+        stays.append(nodes[node])
+    return stays[::-1]
+
+
+def make_stays(plan, start_datetime):
+    # One night per planned site, so the result can go straight into
+    # Itinerary.add_stay; the schedule engine can refine the times later.
+    day = start_datetime.date()
+    result = []
+    for night, candidate in enumerate(plan):
+        stay = events.Stay(
+            sites.Site(
+                candidate.location,
+                candidate.elevation,
+                name=candidate.name,
+            ),
+            datetime.combine(day + timedelta(days=night), ARRIVE_TIME),
+            datetime.combine(day + timedelta(days=night + 1), DEPART_TIME),
+            needs_permit=candidate.needs_permit,
+        )
+        if candidate.has_water:
+            stay.site.add_water()
+        result.append(stay)
+    return result
+
+
+def trailhead_candidate(event):
+    return Candidate(
+        event.site.location,
+        event.site.elevation,
+        event.site.name,
+        event.site.has_water,
+    )
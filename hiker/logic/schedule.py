@@ -0,0 +1,108 @@
+from datetime import timedelta
+
+from . import sites, events
+
+# Naismith's rule in miles and feet: three miles an hour on the flat, plus
+# an hour for every 2000 ft climbed.
+DEFAULT_PACE = 3.0
+DEFAULT_CLIMB_RATE = 2000.0
+DEFAULT_REST_HOURS = 14.0
+
+
+class PaceModel:
+
+    def __init__(
+        self,
+        pace=DEFAULT_PACE,
+        climb_rate=DEFAULT_CLIMB_RATE,
+        rest_hours=DEFAULT_REST_HOURS,
+    ):
+        if pace <= 0 or climb_rate <= 0 or rest_hours < 0:
+            raise ValueError(
+                'Pace and climb rate must be positive and rest not negative'
+            )
+        self.pace = pace
+        self.climb_rate = climb_rate
+        self.rest = timedelta(hours=rest_hours)
+
+    @classmethod
+    def from_config(cls, cfg):
+        return cls(
+            cfg.get('pace_mph', DEFAULT_PACE),
+            cfg.get('climb_rate', DEFAULT_CLIMB_RATE),
+            cfg.get('rest_hours', DEFAULT_REST_HOURS),
+        )
+
+    def travel_time(self, route):
+        return timedelta(hours=(
+            route.length / self.pace
+            + max(route.elevation_change, 0) / self.climb_rate
+        ))
+
+
+def dirty_range(itinerary, items):
+    # Points are numbered start = 0, stays 1..n, end = n + 1; point p is
+    # reached over the route from p - 1. Returns the first and last points
+    # whose arrival an edit to `items` can have moved, or None.
+    first = last = None
+    for item in items:
+        index = itinerary.index(item)
+        if index is None:
+            continue
+        if isinstance(item, sites.Route):
+            low = high = (index + 1) // 2
+        else:
+            # A moved or re-timed site changes the routes on both sides.
+            point = index // 2
+            low, high = max(point, 1), point + 1
+        first = low if first is None else min(first, low)
+        last = high if last is None else max(last, high)
+    if first is None:
+        return None
+    return first, min(last, len(itinerary.stays) + 1)
+
+
+def reschedule(itinerary, model, items=None):
+    # Recomputes arrival and departure times from the first point touched
+    # by `items` (everything, if None). Past the last touched point, it
+    # stops as soon as a departure comes out unchanged, since nothing after
+    # it can move either. Returns the items it changed.
+    stays = itinerary.stays
+    points = [
+        itinerary.starttrailhead_event,
+        *stays,
+        itinerary.endtrailhead_event,
+    ]
+    if items is None:
+        first, last = 1, len(points) - 1
+    else:
+        dirty = dirty_range(itinerary, items)
+        if dirty is None:
+            return []
+        first, last = dirty
+    depart = departure(points[first - 1])
+    changed = []
+    for p in range(first, len(points)):
+        point = points[p]
+        route = itinerary.route_between(points[p - 1].site, point.site)
+        arrive = depart + model.travel_time(route)
+        if isinstance(point, events.EndTrailheadEvent):
+            if point.datetime != arrive:
+                point.datetime = arrive
+                changed.append(point)
+            break
+        depart = arrive + model.rest
+        if point.arrive_datetime == arrive and point.depart_datetime == depart:
+            if p >= last:
+                break
+            continue
+        point.arrive_datetime = arrive
+        point.depart_datetime = depart
+        changed.append(point)
+    return changed
+
+
+def departure(point):
+    if isinstance(point, events.Stay):
+        return point.depart_datetime
+    return point.datetime
@@ -1,5 +1,7 @@
+import bisect
 import uuid
-from . import features
+from . import features, events, water
+from .base import Slotted
 
 
 def uuid4():
@@ -7,9 +9,11 @@ def uuid4():
     return int(str(u)[:7])
 
 
-class Site:
+class Site(features.Featured):
 
-    def __init__(self, location, elevation, features=[], name=''):
+    __slots__ = ('location', 'elevation', '_name', 'id')
+
+    def __init__(self, location, elevation, features=None, name=''):
         self.location = location
         self.elevation = elevation
         self.features = features
@@ -20,29 +24,6 @@ class Site:
     def deletable(self):
         return False
 
-    @property
-    def has_water(self):
-        return True in [
-            isinstance(feature, features.WaterFeature)
-            for feature in self.features
-        ]
-
-    def add_feature(self, feature):
-        self.features.append(feature)
-
-    def remove_feature(self, feature):
-        for feat in self.features:
-            if feat is feature:
-                self.features.remove(feature)
-
-    def remove_water(self):
-        for feature in self.features:
-            if isinstance(feature, features.WaterFeature):
-                self.remove_feature(feature)
-
-    def add_water(self):
-        self.features.append(features.WaterFeature())
-
     @property
     def name(self):
         return self._name
@@ -80,20 +61,44 @@ class Site:
         return '\n'.join(lines)
 
 
-class Route:
+class Route(features.Featured):
+
+    __slots__ = ('site1', 'site2', 'id', 'note', 'name')
 
-    def __init__(self, site1, site2, features, note='', name=None):
+    padx = 1
+
+    def __init__(self, site1, site2, features=None, note='', name=None):
         self.site1 = site1
         self.site2 = site2
         self.features = features
-        self.padx = 1
         self.id = uuid4()
-        self.note = ''
+        self.note = note
         if name is None:
-            self.name = f'Trail from {self.site1.name} to {self.site2.name}'
+            self.name = self.default_name
         else:
             self.name = name
 
+    @property
+    def default_name(self):
+        return f'Trail from {self.site1.name} to {self.site2.name}'
+
+    def reconnect(self, site1, site2):
+        rename = self.name == self.default_name
+        self.site1 = site1
+        self.site2 = site2
+        if rename:
+            self.name = self.default_name
+
+    def split(self, site):
+        route = Route(site, self.site2, self.features)
+        self.reconnect(self.site1, site)
+        return route
+
+    def merge(self, route):
+        self.add_feature(route.features)
+        self.note = '\n'.join(note for note in (self.note, route.note) if note)
+        self.reconnect(self.site1, route.site2)
+
     def entrylines(self):
         result = []
         result.append(f'--> {self.name}')
@@ -109,30 +114,6 @@ class Route:
     def length(self):
         return abs(self.site2.location - self.site1.location)
 
-    @property
-    def has_water(self):
-        return True in [
-            isinstance(feature, features.WaterFeature)
-            for feature in self.features
-        ]
-
-    def add_feature(self, feature):
-        self.features.append(feature)
-
-    def remove_feature(self, feature):
-        try:
-            self.features.remove(feature)
-        except ValueError:
-            pass
-
-    def remove_water(self):
-        for feature in self.features:
-            if isinstance(feature, features.WaterFeature):
-                self.remove_feature(feature)
-
-    def add_water(self):
-        self.features.append(features.WaterFeature())
-
     @property
     def elevation_change(self):
         return self.site2.elevation - self.site1.elevation
@@ -157,17 +138,52 @@ class Route:
 
 class StartTrailhead(Site):
 
-    def __init__(self, elevation, features=[], name='Start'):
+    __slots__ = ()
+
+    def __init__(self, elevation, features=None, name='Start'):
         super().__init__(0, elevation, features, name)
 
 
 class EndTrailhead(Site):
 
-    def __init__(self, location, elevation, features=[], name='End'):
+    __slots__ = ()
+
+    def __init__(self, location, elevation, features=None, name='End'):
         super().__init__(location, elevation, features, name)
 
 
-class Itinerary:
+def stay_key(stay):
+    return stay.event1.datetime
+
+
+def _position(items, item, key):
+    # Fall back to a linear scan when the item's sort key was edited in
+    # place and no longer matches its slot.
+    i = bisect.bisect_left(items, key(item), key=key)
+    while i < len(items) and key(items[i]) == key(item):
+        if items[i] is item:
+            return i
+        i += 1
+    for i, im in enumerate(items):
+        if im is item:
+            return i
+    raise ValueError('No such item')
+
+
+class Itinerary(Slotted):
+
+    __slots__ = (
+        'starttrailhead_event',
+        'endtrailhead_event',
+        '_stays',
+        '_routes',
+        '_items',
+        'id',
+        'version',
+        'note',
+        'name',
+        '_water',
+    )
 
     def __init__(
         self,
@@ -178,66 +194,215 @@ class Itinerary:
         note='',
         name='',
     ):
+        self._water = None
         self.starttrailhead_event = starttrailhead_event
         self.endtrailhead_event = endtrailhead_event
-        self._stays = []
-        self._routes = []
-        for event in stays:
-            self.add_stay(event)
+        self._stays = sorted(stays, key=stay_key)
+        self._routes = {}
+        self._items = {
+            starttrailhead_event.id: starttrailhead_event,
+            endtrailhead_event.id: endtrailhead_event,
+        }
+        for stay in self._stays:
+            self._items[stay.id] = stay
         for route in routes:
             self.add_route(route)
         self.autofill_routes()
         self.id = uuid4()
+        self.version = 0
         self.note = note
         self.name = name
         if self.name == '':
             self.name = 'Itinerary'
 
+    def __getstate__(self):
+        # The water index is derived, so it is rebuilt rather than stored.
+        state = super().__getstate__()
+        state[-1] = None
+        return state
+
+    def _restore(self, state):
+        super()._restore(state)
+        self._water = None
+        if 'version' not in state:
+            self.version = 0
+        if isinstance(self._routes, list):
+            routes = self._routes
+            self._stays.sort(key=stay_key)
+            self._routes = {}
+            self._items = {
+                item.id: item
+                for item in (
+                    self.starttrailhead_event,
+                    self.endtrailhead_event,
+                    *self._stays,
+                )
+            }
+            for route in routes:
+                self.add_route(route)
+            self.autofill_routes()
+
+    def __contains__(self, item):
+        return self._items.get(item.id) is item
+
+    def _site_before(self, i):
+        if i == 0:
+            return self.starttrailhead_event.site
+        return self._stays[i-1].site
+
+    def _site_after(self, i):
+        if i == len(self._stays) - 1:
+            return self.endtrailhead_event.site
+        return self._stays[i+1].site
+
+    def _pop_route(self, site1, site2):
+        route = self._routes.pop((site1, site2), None)
+        if route is not None:
+            del self._items[route.id]
+        return route
+
     def index(self, item):
-        for i, im in enumerate(self.traverse()):
-            if im.id == item.id:
-                return i
+        if item is self.starttrailhead_event:
+            return 0
+        if item is self.endtrailhead_event:
+            return 2 * len(self._stays) + 2
+        if item.id not in self._items:
+            return None
+        if isinstance(item, Route):
+            if item.site1 is self.starttrailhead_event.site:
+                return 1
+            for i, stay in enumerate(self._stays):
+                if stay.site is item.site1:
+                    return 2 * i + 3
+        return 2 * _position(self._stays, item, stay_key) + 2
+
+    def water_index(self):
+        if self._water is None:
+            self._water = water.WaterIndex.build(self)
+        return self._water
+
+    def water_changed(self, items):
+        # Keeps the water index, once built, in step with items that were
+        # added, removed, moved or had their water toggled.
+        if self._water is None:
+            return
+        self._water.set_bounds(
+            self.starttrailhead_event.site.location,
+            self.endtrailhead_event.site.location,
+        )
+        for item in items:
+            present = item in self
+            self._water.update(item, present)
+            if present and not isinstance(item, Route):
+                for route in self.adjacent_routes(item):
+                    self._water.update(route)
+
+    def adjacent_routes(self, item):
+        site = item.site
+        if item is self.starttrailhead_event:
+            pairs = [(site, self._site_after(-1))]
+        elif item is self.endtrailhead_event:
+            pairs = [(self._site_before(len(self._stays)), site)]
+        else:
+            i = _position(self._stays, item, stay_key)
+            pairs = [(self._site_before(i), site), (site, self._site_after(i))]
+        return [
+            route for route in (self.route_between(*pair) for pair in pairs)
+            if route is not None
+        ]
+
+    def route_between(self, site1, site2):
+        return self._routes.get((site1, site2))
 
     def remove_route(self, route):
-        for r in self._routes:
-            if route.id == r.id:
-                self._routes.remove(route)
+        if self._routes.get((route.site1, route.site2)) is route:
+            self._pop_route(route.site1, route.site2)
+
+    def _detach(self, i):
+        stay = self._stays[i]
+        site1 = self._site_before(i)
+        site2 = self._site_after(i)
+        route1 = self._pop_route(site1, stay.site)
+        route2 = self._pop_route(stay.site, site2)
+        del self._stays[i]
+        if route1 is None:
+            route1, route2 = route2, None
+        if route1 is None:
+            route1 = Route(site1, site2, features=[])
+        elif route2 is None:
+            route1.reconnect(site1, site2)
+        else:
+            route1.merge(route2)
+        self.add_route(route1)
+        return [route for route in (route1, route2) if route is not None]
+
+    def _attach(self, stay):
+        i = bisect.bisect_right(self._stays, stay_key(stay), key=stay_key)
+        self._stays.insert(i, stay)
+        site1 = self._site_before(i)
+        site2 = self._site_after(i)
+        route1 = self._pop_route(site1, site2)
+        if route1 is None:
+            route1 = Route(site1, stay.site, features=[])
+            route2 = Route(stay.site, site2, features=[])
+        else:
+            route2 = route1.split(stay.site)
+        self.add_route(route1)
+        self.add_route(route2)
+        return [route1, route2]
 
     def remove_stay(self, stay):
-        items = list(self.traverse())
-        for i, item in enumerate(items):
-            if stay.id == item.id:
-                route1 = items[i-1]
-                route2 = items[i+1]
-                self._stays.remove(stay)
-                self.remove_route(route1)
-                self.remove_route(route2)
-        self.autofill_routes()
+        if stay.id not in self._items:
+            return []
+        del self._items[stay.id]
+        touched = self._detach(_position(self._stays, stay, stay_key))
+        self.water_changed([stay, *touched])
+        return touched
 
     def _add_stay(self, stay):
-        self._stays.append(stay)
+        self._items[stay.id] = stay
+        touched = self._attach(stay)
+        self.water_changed([stay, *touched])
+        return touched
 
     def add_stay(self, stay):
-        self._add_stay(stay)
-        self.autofill_routes()
+        return self._add_stay(stay)
 
     def add_route(self, route):
-        self._routes.append(route)
+        self._routes[route.site1, route.site2] = route
+        self._items[route.id] = route
+
+    def reorder(self, item):
+        if not isinstance(item, events.Stay) or item.id not in self._items:
+            return []
+        i = _position(self._stays, item, stay_key)
+        key = stay_key(item)
+        if (
+            (i == 0 or stay_key(self._stays[i-1]) <= key)
+            and (i == len(self._stays) - 1 or key <= stay_key(self._stays[i+1]))
+        ):
+            return []
+        touched = self._detach(i) + self._attach(item)
+        self.water_changed(touched)
+        return touched
 
     def autofill_routes(self):
+        self._water = None
+        routes = {}
         site1 = self.starttrailhead_event.site
-        for stay in self.stays:
-            site2 = stay.site
-            if True not in [
-                route.is_between(site1, site2) for route in self.routes
-            ]:
-                self.add_route(Route(site1, site2, features=[]))
-            site1 = site2
-        site2 = self.endtrailhead_event.site
-        if True not in [
-            route.is_between(site1, site2) for route in self.routes
+        for site2 in [stay.site for stay in self._stays] + [
+            self.endtrailhead_event.site,
         ]:
-            self.add_route(Route(site1, site2, features=[]))
+            route = self._routes.pop((site1, site2), None)
+            if route is None:
+                route = Route(site1, site2, features=[])
+            routes[site1, site2] = route
+            site1 = site2
+        for route in self._routes.values():
+            del self._items[route.id]
+        self._routes = routes
+        for route in routes.values():
+            self._items[route.id] = route
 
     @property
     def deletable(self):
@@ -245,24 +410,30 @@ class Itinerary:
 
     @property
     def stays(self):
-        return list(sorted(self._stays, key=lambda x: x.event1.datetime))
+        return list(self._stays)
+
+    def _chain(self):
+        site1 = self.starttrailhead_event.site
+        for stay in self._stays:
+            yield self._routes[site1, stay.site]
+            site1 = stay.site
+        yield self._routes[site1, self.endtrailhead_event.site]
 
     @property
     def routes(self):
-        return list(sorted(self._routes, key=lambda x: x.site1))
+        return list(self._chain())
 
     def traverse(self):
-        result = []
-        result.append(self.starttrailhead_event)
-        for stay, route in zip(self.stays, self.routes):
-            result.append(route)
-            result.append(stay)
-        result.append(self.routes[-1])
-        result.append(self.endtrailhead_event)
-        yield from result
+        routes = self._chain()
+        yield self.starttrailhead_event
+        for stay in self._stays:
+            yield next(routes)
+            yield stay
+        yield next(routes)
+        yield self.endtrailhead_event
 
     def get_item(self, id):
-        for item in self.traverse():
-            if item.id == id:
-                return item
-        raise ValueError('No such id')
+        try:
+            return self._items[id]
+        except KeyError:
+            raise ValueError('No such id') from None
@@ -0,0 +1,141 @@
+import numpy as np
+
+from ..database import timestamp
+
+
+def seconds(datetimes, count):
+    # Much faster than letting NumPy convert datetime objects itself.
+    return np.fromiter(
+        (timestamp(value) for value in datetimes),
+        np.int64,
+        count,
+    ).astype('datetime64[s]')
+
+
+def points(itinerary):
+    # Trailheads and stays in travel order, as parallel arrays. A point is
+    # reached at `arrive` and left at `depart`; the start trailhead is never
+    # arrived at and the end trailhead never left.
+    start = itinerary.starttrailhead_event
+    end = itinerary.endtrailhead_event
+    stays = itinerary.stays
+    n = len(stays) + 2
+    location = np.empty(n)
+    elevation = np.empty(n)
+    location[0], elevation[0] = start.site.location, start.site.elevation
+    location[-1], elevation[-1] = end.site.location, end.site.elevation
+    location[1:-1] = np.fromiter(
+        (stay.site.location for stay in stays), float, len(stays),
+    )
+    elevation[1:-1] = np.fromiter(
+        (stay.site.elevation for stay in stays), float, len(stays),
+    )
+    arrive = seconds(
+        [start.datetime] + [stay.arrive_datetime for stay in stays]
+        + [end.datetime],
+        n,
+    )
+    depart = seconds(
+        [start.datetime] + [stay.depart_datetime for stay in stays]
+        + [end.datetime],
+        n,
+    )
+    return location, elevation, arrive, depart
+
+
+def segment(routes, i, distance, climb):
+    if i is None:
+        return None
+    return {
+        'id': routes[i].id,
+        'name': routes[i].name,
+        'distance': float(distance[i]),
+        'elevation_change': float(climb[i]),
+    }
+
+
+def trip_stats(itinerary):
+    location, elevation, arrive, depart = points(itinerary)
+    routes = itinerary.routes
+
+    distance = np.abs(np.diff(location))
+    climb = np.diff(elevation)
+    cumulative = np.cumsum(distance)
+    # Hours on the trail per segment, from leaving one point to reaching
+    # the next. Out-of-order times count as zero rather than negative.
+    hours = np.maximum(
+        (arrive[1:] - depart[:-1]).astype('timedelta64[s]').astype(float)
+        / 3600,
+        0,
+    )
+    moving = hours > 0
+    pace = np.full(distance.shape, np.nan)
+    np.divide(distance, hours, out=pace, where=moving)
+    grade = np.zeros(distance.shape)
+    np.divide(np.abs(climb), distance, out=grade, where=distance > 0)
+
+    # Each segment counts towards the day it was started on.
+    days, day_index = np.unique(
+        depart[:-1].astype('datetime64[D]'),
+        return_inverse=True,
+    )
+    daily_distance = np.bincount(day_index, distance, len(days))
+    daily_gain = np.bincount(day_index, np.maximum(climb, 0), len(days))
+    daily_loss = np.bincount(day_index, np.maximum(-climb, 0), len(days))
+
+    total_distance = float(cumulative[-1])
+    total_hours = float(hours.sum())
+    return {
+        'distance': total_distance,
+        'gain': float(daily_gain.sum()),
+        'loss': float(daily_loss.sum()),
+        'moving_hours': total_hours,
+        'pace': total_distance / total_hours if total_hours else None,
+        'cumulative_distance': cumulative.tolist(),
+        'segment_pace': [
+            None if value != value else value for value in pace.tolist()
+        ],
+        'days': [
+            {
+                'date': day,
+                'distance': day_distance,
+                'gain': gain,
+                'loss': loss,
+            }
+            for day, day_distance, gain, loss in zip(
+                np.datetime_as_string(days).tolist(),
+                daily_distance.tolist(),
+                daily_gain.tolist(),
+                daily_loss.tolist(),
+            )
+        ],
+        'longest': segment(
+            routes, int(np.argmax(distance)), distance, climb,
+        ),
+        'steepest': segment(
+            routes,
+            int(np.argmax(grade)) if grade.any() else None,
+            distance,
+            climb,
+        ),
+    }
+
+
+def summary_lines(stats):
+    result = ['Trip statistics']
+    result.append(f'\tDistance: {stats["distance"]:g}')
+    result.append(f'\tElevation gain: {stats["gain"]:g}')
+    result.append(f'\tElevation loss: {stats["loss"]:g}')
+    result.append(f'\tTime moving: {stats["moving_hours"]:.1f} h')
+    if stats['pace'] is not None:
+        result.append(f'\tPace: {stats["pace"]:.2f} per hour')
+    result.append(f'\tLongest segment: {stats["longest"]["name"]} '
+                  f'({stats["longest"]["distance"]:g})')
+    if stats['steepest'] is not None:
+        result.append(f'\tSteepest segment: {stats["steepest"]["name"]} '
+                      f'({stats["steepest"]["elevation_change"]:+g} over '
+                      f'{stats["steepest"]["distance"]:g})')
+    for day in stats['days']:
+        result.append(f'\t{day["date"]}: {day["distance"]:g} '
+                      f'(+{day["gain"]:g} / -{day["loss"]:g})')
+    return result
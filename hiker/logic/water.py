@@ -0,0 +1,159 @@
+import heapq
+from bisect import bisect_left, bisect_right, insort
+
+
+def source_location(item):
+    # Where along the trail an item provides water, or None. A route only
+    # says it has water somewhere, so it is counted at its midpoint.
+    if hasattr(item, 'site1'):
+        if not item.has_water:
+            return None
+        return (item.site1.location + item.site2.location) / 2
+    if not item.site.has_water:
+        return None
+    return item.site.location
+
+
+class WaterIndex:
+
+    # Water sources are kept as a sorted list of distinct locations, so
+    # next-water is a bisect. The stretches between neighbouring sources
+    # (and the trip's ends) sit in a max-heap; entries are not removed when
+    # a source comes or goes, but stale ones are popped off the top after
+    # each change. Queries then change nothing, so the index of a cached
+    # itinerary can be read by several threads at once.
+
+    def __init__(self, start, end):
+        self.start = start
+        self.end = end
+        self._sources = {}
+        self._counts = {}
+        self._locations = []
+        self._gaps = []
+
+    @classmethod
+    def build(cls, itinerary):
+        index = cls(
+            itinerary.starttrailhead_event.site.location,
+            itinerary.endtrailhead_event.site.location,
+        )
+        for item in itinerary.traverse():
+            location = source_location(item)
+            if location is not None:
+                index._sources[item.id] = location
+                index._counts[location] = index._counts.get(location, 0) + 1
+        index._locations = sorted(index._counts)
+        index._rebuild_gaps()
+        return index
+
+    def __len__(self):
+        return len(self._sources)
+
+    def locations(self):
+        return list(self._locations)
+
+    def set_bounds(self, start, end):
+        if (start, end) != (self.start, self.end):
+            self.start, self.end = start, end
+            self._rebuild_gaps()
+
+    def update(self, item, present=True):
+        location = source_location(item) if present else None
+        old = self._sources.pop(item.id, None)
+        if location is not None:
+            self._sources[item.id] = location
+        if old == location:
+            return
+        if old is not None:
+            self._remove(old)
+        if location is not None:
+            self._add(location)
+        self._drop_stale()
+
+    def next_water(self, location):
+        i = bisect_left(self._locations, location)
+        if i == len(self._locations):
+            return None
+        return self._locations[i]
+
+    def max_gap(self):
+        # (from, to) of the longest stretch without water, or None if the
+        # trip has no length.
+        if not self._gaps:
+            return None
+        return self._gaps[0][1], self._gaps[0][2]
+
+    def _drop_stale(self):
+        gaps = self._gaps
+        while gaps and not self._is_gap(gaps[0][1], gaps[0][2]):
+            heapq.heappop(gaps)
+
+    def _rebuild_gaps(self):
+        points = [self.start]
+        points += [
+            location for location in self._locations
+            if self.start < location < self.end
+        ]
+        points.append(self.end)
+        self._gaps = [
+            (left - right, left, right)
+            for left, right in zip(points, points[1:])
+            if right > left
+        ]
+        heapq.heapify(self._gaps)
+
+    def _neighbours(self, location):
+        i = bisect_left(self._locations, location)
+        left = self._locations[i - 1] if i else self.start
+        right = (
+            self._locations[i] if i < len(self._locations) else self.end
+        )
+        return max(left, self.start), min(right, self.end)
+
+    def _push(self, left, right):
+        left, right = max(left, self.start), min(right, self.end)
+        if right > left:
+            heapq.heappush(self._gaps, (left - right, left, right))
+        if len(self._gaps) > 4 * len(self._locations) + 16:
+            self._rebuild_gaps()
+
+    def _add(self, location):
+        if location in self._counts:
+            self._counts[location] += 1
+            return
+        left, right = self._neighbours(location)
+        self._counts[location] = 1
+        insort(self._locations, location)
+        self._push(left, location)
+        self._push(location, right)
+
+    def _remove(self, location):
+        self._counts[location] -= 1
+        if self._counts[location]:
+            return
+        del self._counts[location]
+        del self._locations[bisect_left(self._locations, location)]
+        self._push(*self._neighbours(location))
+
+    def _is_gap(self, left, right):
+        if left < self.start or right > self.end:
+            return False
+        if left != self.start and left not in self._counts:
+            return False
+        if right != self.end and right not in self._counts:
+            return False
+        i = bisect_right(self._locations, left)
+        return i == len(self._locations) or self._locations[i] >= right
+
+
+def summary_lines(index):
+    result = ['Water']
+    gap = index.max_gap()
+    if gap is not None:
+        result.append(f'\tLongest stretch without water: {gap[1] - gap[0]:g} '
+                      f'(from {gap[0]:g} to {gap[1]:g})')
+    result.append('\tSources at: ' + (
+        ', '.join(f'{location:g}' for location in index.locations())
+        or 'none'
+    ))
+    return result
@@ -0,0 +1,246 @@
+import os
+import random
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from threading import Lock
+
+# Seconds, from half a millisecond to ten seconds.
+DEFAULT_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+    0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+DEFAULT_PROFILE_THRESHOLD = 1.0
+DEFAULT_PROFILE_KEEP = 50
+
+
+def _escape(value):
+    return (
+        str(value)
+        .replace('\\', '\\\\')
+        .replace('"', '\\"')
+        .replace('\n', '\\n')
+    )
+
+
+def _labels(names, values, extra=()):
+    pairs = [*zip(names, values), *extra]
+    if not pairs:
+        return ''
+    return '{' + ','.join(
+        f'{name}="{_escape(value)}"' for name, value in pairs
+    ) + '}'
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+
+    kind = 'counter'
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels[name]) for name in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def reset(self):
+        self._values = {}
+        self._lock = Lock()
+
+    def lines(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        for key, value in values:
+            yield f'{self.name}{_labels(self.labels, key)} {_number(value)}'
+
+
+class Histogram:
+
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        # Per label set: the count in each bucket (not cumulative, the last
+        # one being +Inf) and the sum.
+        self._values = {}
+        self._lock = Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels[name]) for name in self.labels)
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0]
+            entry[0][i] += 1
+            entry[1] += value
+
+    def reset(self):
+        self._values = {}
+        self._lock = Lock()
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def lines(self):
+        with self._lock:
+            values = sorted(
+                (key, list(counts), total)
+                for key, (counts, total) in self._values.items()
+            )
+        for key, counts, total in values:
+            cumulative = 0
+            for bound, count in zip((*self.buckets, float('inf')), counts):
+                cumulative += count
+                labels = _labels(self.labels, key, [('le', _number(bound))])
+                yield f'{self.name}_bucket{labels} {cumulative}'
+            labels = _labels(self.labels, key)
+            yield f'{self.name}_sum{labels} {_number(total)}'
+            yield f'{self.name}_count{labels} {cumulative}'
+
+
+class Registry:
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def counter(self, name, help, labels=()):
+        metric = Counter(name, help, labels)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        metric = Histogram(name, help, labels, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def collector(self, func):
+        # For values that are kept elsewhere and read at scrape time. func
+        # returns (name, kind, help, value) tuples.
+        self._collectors.append(func)
+        return func
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            lines.extend(metric.lines())
+        for func in self._collectors:
+            for name, kind, help, value in func():
+                lines.append(f'# HELP {name} {help}')
+                lines.append(f'# TYPE {name} {kind}')
+                lines.append(f'{name} {_number(value)}')
+        return '\n'.join(lines) + '\n'
+
+    def reset(self):
+        for metric in self._metrics:
+            metric.reset()
+
+
+# Each worker process keeps its own; Prometheus tells them apart by
+# instance.
+registry = Registry()
+REQUEST_SECONDS = registry.histogram(
+    'hiker_request_duration_seconds',
+    'Time to handle a request, by view.',
+    ('endpoint', 'method', 'status'),
+)
+PHASE_SECONDS = registry.histogram(
+    'hiker_phase_duration_seconds',
+    'Time spent in each phase of handling requests.',
+    ('phase',),
+)
+STORAGE_OPERATIONS = registry.counter(
+    'hiker_storage_operations_total',
+    'Itinerary loads, saves, journal records and deletes.',
+    ('operation',),
+)
+PROFILES_WRITTEN = registry.counter(
+    'hiker_profiles_written_total',
+    'Slow requests whose profile was written to the data dir.',
+)
+
+
+def timed(phase):
+    return PHASE_SECONDS.time(phase=phase)
+
+
+# Slow-request profiling. A share of requests, profile_rate, runs under
+# cProfile, and those that take longer than profile_threshold seconds have
+# their stats written to <data_dir>/profiles for pstats or snakeviz. Only
+# one request is profiled at a time, as a profiler slows down everything
+# else running alongside it.
+_profile_lock = Lock()
+
+
+def start_profile(rate):
+    if rate <= 0 or random.random() >= rate:
+        return None
+    if not _profile_lock.acquire(blocking=False):
+        return None
+    import cProfile
+    profile = cProfile.Profile()
+    try:
+        profile.enable()
+    except BaseException:
+        _profile_lock.release()
+        raise
+    return profile
+
+
+def finish_profile(profile, elapsed, threshold, directory, name, keep):
+    try:
+        profile.disable()
+    finally:
+        _profile_lock.release()
+    if elapsed < threshold:
+        return None
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    path = directory / (
+        f'{datetime.now():%Y%m%d-%H%M%S}-{name}-{elapsed * 1000:.0f}ms'
+        f'-{os.getpid()}.prof'
+    )
+    profile.dump_stats(path)
+    PROFILES_WRITTEN.inc()
+    # Names start with the time, so they sort oldest first.
+    profiles = sorted(directory.glob('*.prof'))
+    for old in profiles[:max(len(profiles) - keep, 0)]:
+        old.unlink(missing_ok=True)
+    return path
+
+
+def _after_fork():
+    # A worker starts from zero rather than from whatever its parent had
+    # counted, and not with a lock some other thread of the parent held.
+    global _profile_lock
+    registry.reset()
+    _profile_lock = Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork)
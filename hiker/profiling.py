@@ -0,0 +1,71 @@
+import os
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+
+def import_times(module='hiker'):
+    # `python -m hiker` has already imported the package by the time this
+    # runs, so imports are timed in a fresh interpreter.
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        [str(Path(__file__).resolve().parent.parent)]
+        + [p for p in [env.get('PYTHONPATH')] if p]
+    )
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        capture_output=True,
+        text=True,
+        env=env,
+    )
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or '[us]' in line:
+            continue
+        prefix, cumulative_us, name = line.split('|')
+        self_us = prefix.split(':')[1]
+        name = name[1:]
+        depth = (len(name) - len(name.lstrip(' '))) // 2
+        rows.append((name.strip(), depth, int(self_us), int(cumulative_us)))
+    return rows
+
+
+def timed(phases, name, func):
+    start = time.perf_counter()
+    result = func()
+    phases.append((name, time.perf_counter() - start))
+    return result
+
+
+def profile_startup(limit=15, out=sys.stdout):
+    from . import app, config, get_catalog, get_cfg
+    from .config import Config
+    from .storage import open_storage
+
+    rows = import_times()
+    total = next((row for row in rows if row[0] == 'hiker'), None)
+    if total is not None:
+        print(f'import hiker: {total[3] / 1000:8.1f} ms', file=out)
+    print('slowest imports below hiker:', file=out)
+    children = sorted(
+        (row for row in rows if row[1] == 1),
+        key=lambda row: row[3],
+        reverse=True,
+    )
+    for name, _, _, cumulative_us in children[:limit]:
+        print(f'  {name:<30} {cumulative_us / 1000:8.1f} ms', file=out)
+
+    phases = []
+    timed(phases, 'load config', Config(config.path).load)
+    cfg = get_cfg()
+    timed(phases, 'open storage', lambda: open_storage(cfg).ids())
+    timed(phases, 'read catalog', lambda: get_catalog().entries())
+    timed(phases, 'compile templates', lambda: [
+        app.jinja_env.get_template(name)
+        for name in app.jinja_env.list_templates()
+    ])
+    timed(phases, 'first request', lambda: app.test_client().get('/load'))
+    print('initialization:', file=out)
+    for name, seconds in phases:
+        print(f'  {name:<30} {seconds * 1000:8.1f} ms', file=out)
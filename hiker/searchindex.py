@@ -0,0 +1,331 @@
+import re
+
+from .database import Database, from_timestamp, timestamp
+from .logic import sites, events
+
+KINDS = ('itinerary', 'trailhead', 'stay', 'route')
+DEFAULT_LIMIT = 50
+# Item ids are never 0, so the itinerary itself is indexed as item 0.
+ITINERARY_ITEM = 0
+
+# One row per itinerary and per item in it. Names and notes go into an FTS5
+# index over the items table, and dates and locations into R*Trees, which
+# answer "overlaps this range" without scanning. The R*Trees store 32-bit
+# floats and round outwards, so queries check the exact columns as well.
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS itineraries (
+    id INTEGER PRIMARY KEY,
+    version INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS items (
+    rowid INTEGER PRIMARY KEY,
+    itinerary_id INTEGER NOT NULL,
+    item_id INTEGER NOT NULL,
+    kind TEXT NOT NULL,
+    name TEXT NOT NULL,
+    note TEXT NOT NULL,
+    start_ts INTEGER,
+    end_ts INTEGER,
+    low REAL NOT NULL,
+    high REAL NOT NULL,
+    needs_permit INTEGER NOT NULL,
+    UNIQUE (itinerary_id, item_id)
+);
+CREATE INDEX IF NOT EXISTS items_permit ON items (itinerary_id)
+    WHERE needs_permit;
+CREATE VIRTUAL TABLE IF NOT EXISTS item_text USING fts5(
+    name, note,
+    content='items', content_rowid='rowid',
+    tokenize='unicode61 remove_diacritics 2', prefix='2 3 4'
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS item_dates USING rtree(id, start, end);
+CREATE VIRTUAL TABLE IF NOT EXISTS item_locations USING rtree(id, low, high);
+
+CREATE TRIGGER IF NOT EXISTS items_insert AFTER INSERT ON items BEGIN
+    INSERT INTO item_text (rowid, name, note)
+        VALUES (new.rowid, new.name, new.note);
+    INSERT INTO item_dates SELECT new.rowid, new.start_ts, new.end_ts
+        WHERE new.start_ts IS NOT NULL;
+    INSERT INTO item_locations VALUES (new.rowid, new.low, new.high);
+END;
+CREATE TRIGGER IF NOT EXISTS items_delete AFTER DELETE ON items BEGIN
+    INSERT INTO item_text (item_text, rowid, name, note)
+        VALUES ('delete', old.rowid, old.name, old.note);
+    DELETE FROM item_dates WHERE id = old.rowid;
+    DELETE FROM item_locations WHERE id = old.rowid;
+END;
+CREATE TRIGGER IF NOT EXISTS items_update AFTER UPDATE ON items BEGIN
+    INSERT INTO item_text (item_text, rowid, name, note)
+        VALUES ('delete', old.rowid, old.name, old.note);
+    INSERT INTO item_text (rowid, name, note)
+        VALUES (new.rowid, new.name, new.note);
+    DELETE FROM item_dates WHERE id = old.rowid;
+    INSERT INTO item_dates SELECT new.rowid, new.start_ts, new.end_ts
+        WHERE new.start_ts IS NOT NULL;
+    UPDATE item_locations SET low = new.low, high = new.high
+        WHERE id = new.rowid;
+END;
+'''
+
+UPSERT_ITEM = (
+    'INSERT INTO items (itinerary_id, item_id, kind, name, note, start_ts, '
+    'end_ts, low, high, needs_permit) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?) '
+    'ON CONFLICT (itinerary_id, item_id) DO UPDATE SET kind = excluded.kind, '
+    'name = excluded.name, note = excluded.note, '
+    'start_ts = excluded.start_ts, end_ts = excluded.end_ts, '
+    'low = excluded.low, high = excluded.high, '
+    'needs_permit = excluded.needs_permit '
+    # Rewriting a row updates the text and range indexes, so rows that have
+    # not changed are left alone.
+    'WHERE (kind, name, note, start_ts, end_ts, low, high, needs_permit) '
+    'IS NOT (excluded.kind, excluded.name, excluded.note, excluded.start_ts, '
+    'excluded.end_ts, excluded.low, excluded.high, excluded.needs_permit)'
+)
+
+
+def span(first, second):
+    # Times can be out of order while a trip is being edited; the index
+    # only cares about the period covered.
+    return sorted((timestamp(first), timestamp(second)))
+
+
+def item_row(itinerary_id, item):
+    if isinstance(item, sites.Route):
+        low, high = sorted((item.site1.location, item.site2.location))
+        return (
+            itinerary_id, item.id, 'route', item.name, item.note,
+            None, None, low, high, 0,
+        )
+    if isinstance(item, events.Stay):
+        return (
+            itinerary_id, item.id, 'stay', item.site.name, item.note,
+            *span(item.arrive_datetime, item.depart_datetime),
+            item.site.location, item.site.location, int(item.needs_permit),
+        )
+    return (
+        itinerary_id, item.id, 'trailhead', item.site.name, item.note,
+        timestamp(item.datetime), timestamp(item.datetime),
+        item.site.location, item.site.location, 0,
+    )
+
+
+def itinerary_row(itinerary):
+    # The trip as a whole needs a permit if any of its stays does.
+    start = itinerary.starttrailhead_event
+    end = itinerary.endtrailhead_event
+    low, high = sorted((start.site.location, end.site.location))
+    return (
+        itinerary.id, ITINERARY_ITEM, 'itinerary', itinerary.name,
+        itinerary.note, *span(start.datetime, end.datetime),
+        low, high, int(any(stay.needs_permit for stay in itinerary.stays)),
+    )
+
+
+def match_expression(text):
+    # Every word has to appear; the last may be unfinished, so it only has
+    # to start a word. Quoting each one keeps FTS5 operators in user input
+    # inert.
+    words = [f'"{word}"' for word in re.findall(r'\w+', text)]
+    if words:
+        words[-1] += '*'
+    return ' '.join(words)
+
+
+class SearchIndex(Database):
+
+    schema = SCHEMA
+
+    def ids(self):
+        return [
+            row[0]
+            for row in self.connection.execute('SELECT id FROM itineraries')
+        ]
+
+    def in_sync(self, itinerary_ids):
+        return set(itinerary_ids) == set(self.ids())
+
+    def update(self, itinerary, changed=None):
+        with self.transaction() as conn:
+            self._index(conn, itinerary, changed)
+
+    def remove(self, itinerary_id):
+        with self.transaction() as conn:
+            self._remove(conn, itinerary_id)
+
+    def rebuild(self, itineraries):
+        with self.transaction() as conn:
+            for (itinerary_id,) in conn.execute(
+                'SELECT id FROM itineraries',
+            ).fetchall():
+                self._remove(conn, itinerary_id)
+            for itinerary in itineraries:
+                self._index(conn, itinerary)
+
+    def _remove(self, conn, itinerary_id):
+        conn.execute(
+            'DELETE FROM items WHERE itinerary_id = ?',
+            (itinerary_id,),
+        )
+        conn.execute('DELETE FROM itineraries WHERE id = ?', (itinerary_id,))
+
+    def _index(self, conn, itinerary, changed=None):
+        # Only the changed items are rewritten when the index holds the
+        # version just before this one; if another worker's save got in
+        # first, or one was missed, the whole itinerary is.
+        row = conn.execute(
+            'SELECT version FROM itineraries WHERE id = ?',
+            (itinerary.id,),
+        ).fetchone()
+        if row is not None and row[0] >= itinerary.version:
+            return
+        if row is None or row[0] != itinerary.version - 1:
+            changed = None
+        if changed is None:
+            self._reindex(conn, itinerary)
+        for item in self._with_routes(itinerary, changed or ()):
+            if item in itinerary:
+                conn.execute(UPSERT_ITEM, item_row(itinerary.id, item))
+            else:
+                conn.execute(
+                    'DELETE FROM items WHERE itinerary_id = ? '
+                    'AND item_id = ?',
+                    (itinerary.id, item.id),
+                )
+        conn.execute(UPSERT_ITEM, itinerary_row(itinerary))
+        conn.execute(
+            'INSERT INTO itineraries (id, version) VALUES (?, ?) '
+            'ON CONFLICT (id) DO UPDATE SET version = excluded.version',
+            (itinerary.id, itinerary.version),
+        )
+
+    def _reindex(self, conn, itinerary):
+        items = list(itinerary.traverse())
+        conn.executemany(
+            UPSERT_ITEM,
+            [item_row(itinerary.id, item) for item in items],
+        )
+        stale = {
+            item_id for (item_id,) in conn.execute(
+                'SELECT item_id FROM items WHERE itinerary_id = ? '
+                'AND item_id != ?',
+                (itinerary.id, ITINERARY_ITEM),
+            )
+        }.difference(item.id for item in items)
+        conn.executemany(
+            'DELETE FROM items WHERE itinerary_id = ? AND item_id = ?',
+            [(itinerary.id, item_id) for item_id in stale],
+        )
+
+    def _with_routes(self, itinerary, changed):
+        # A route is described by its sites, so moving or renaming a stay
+        # changes the routes either side of it too.
+        items = {}
+        for item in changed:
+            if item is itinerary:
+                continue
+            items[id(item)] = item
+            if item in itinerary and not isinstance(item, sites.Route):
+                for route in itinerary.adjacent_routes(item):
+                    items[id(route)] = route
+        return items.values()
+
+    def search(
+        self,
+        text='',
+        kind=None,
+        start=None,
+        end=None,
+        low=None,
+        high=None,
+        needs_permit=False,
+        limit=DEFAULT_LIMIT,
+        offset=0,
+    ):
+        # Items matching every given filter: all words of text in the name
+        # or note, dates overlapping start..end and locations overlapping
+        # low..high. One index drives the query (the text index, else the
+        # dates, else the locations) and the other filters are checked row
+        # by row, so it stops as soon as a page is full. Ranking every
+        # match would mean scoring all of them for a common word, so
+        # results come in index order instead: newest first for text.
+        if kind is not None and kind not in KINDS:
+            raise ValueError(f'Cannot search for {kind}')
+        text = match_expression(text)
+        dates = start is not None or end is not None
+        locations = low is not None or high is not None
+        start = -2 ** 62 if start is None else timestamp(start)
+        end = 2 ** 62 if end is None else timestamp(end)
+        low = float('-inf') if low is None else low
+        high = float('inf') if high is None else high
+        where = []
+        params = []
+        if text:
+            source = (
+                'item_text CROSS JOIN items ON items.rowid = item_text.rowid'
+            )
+            where.append('item_text MATCH ?')
+            params.append(text)
+            order = 'ORDER BY item_text.rowid DESC'
+        elif dates:
+            source = (
+                'item_dates CROSS JOIN items ON items.rowid = item_dates.id'
+            )
+            where.append('item_dates.start <= ? AND item_dates.end >= ?')
+            params += [end, start]
+            order = ''
+        elif locations:
+            source = (
+                'item_locations CROSS JOIN items '
+                'ON items.rowid = item_locations.id'
+            )
+            where.append(
+                'item_locations.low <= ? AND item_locations.high >= ?'
+            )
+            params += [high, low]
+            order = ''
+        else:
+            source = 'items'
+            order = 'ORDER BY items.rowid DESC'
+        if kind is not None:
+            where.append('items.kind = ?')
+            params.append(kind)
+        if dates:
+            where.append('items.start_ts <= ? AND items.end_ts >= ?')
+            params += [end, start]
+        if locations:
+            where.append('items.low <= ? AND items.high >= ?')
+            params += [high, low]
+        if needs_permit:
+            where.append('items.needs_permit')
+        query = (
+            'SELECT items.itinerary_id, trip.name, items.item_id, '
+            'items.kind, items.name, items.note, items.start_ts, '
+            'items.end_ts, items.low, items.high, items.needs_permit '
+            f'FROM {source} '
+            'JOIN items AS trip ON trip.itinerary_id = items.itinerary_id '
+            f'AND trip.item_id = {ITINERARY_ITEM} '
+            f'WHERE {" AND ".join(where) or "1"} {order} LIMIT ? OFFSET ?'
+        )
+        return [
+            {
+                'itinerary_id': itinerary_id,
+                'itinerary_name': itinerary_name,
+                'id': item_id,
+                'kind': kind,
+                'name': name,
+                'note': note,
+                'start': None if start is None else (
+                    from_timestamp(start).isoformat()
+                ),
+                'end': None if end is None else (
+                    from_timestamp(end).isoformat()
+                ),
+                'low': low,
+                'high': high,
+                'needs_permit': bool(needs_permit),
+            }
+            for (
+                itinerary_id, itinerary_name, item_id, kind, name, note,
+                start, end, low, high, needs_permit,
+            ) in self.connection.execute(query, [*params, limit, offset])
+        ]
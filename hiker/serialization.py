@@ -0,0 +1,235 @@
+import json
+from datetime import datetime
+
+from .logic import sites, events
+
+
+# Bump SCHEMA_VERSION whenever the layout below changes, and register a
+# @migration(old_version) that rewrites an old document into the next one.
+SCHEMA_VERSION = 2
+MIGRATIONS = {}
+
+SITE_KINDS = (sites.Site, sites.StartTrailhead, sites.EndTrailhead)
+
+
+class SchemaError(ValueError):
+    pass
+
+
+def migration(schema):
+    def register(upgrade):
+        MIGRATIONS[schema] = upgrade
+        return upgrade
+    return register
+
+
+def _dumps(obj):
+    return json.dumps(obj, separators=(',', ':'), ensure_ascii=False)
+
+
+def encode(itinerary):
+    # One header line (cheap to read on its own), then one line holding
+    # parallel arrays per item type. Sites are referenced by array index.
+    site_index = {}
+    site_columns = {
+        'id': [],
+        'kind': [],
+        'location': [],
+        'elevation': [],
+        'name': [],
+        'features': [],
+    }
+
+    def site_ref(site):
+        key = id(site)
+        if key not in site_index:
+            site_index[key] = len(site_columns['id'])
+            site_columns['id'].append(site.id)
+            site_columns['kind'].append(SITE_KINDS.index(type(site)))
+            site_columns['location'].append(site.location)
+            site_columns['elevation'].append(site.elevation)
+            site_columns['name'].append(site.name)
+            site_columns['features'].append(int(site.features))
+        return site_index[key]
+
+    trailheads = (itinerary.starttrailhead_event, itinerary.endtrailhead_event)
+    stays = itinerary.stays
+    routes = itinerary.routes
+    header = {
+        'schema': SCHEMA_VERSION,
+        'version': itinerary.version,
+        'id': itinerary.id,
+    }
+    body = {
+        'name': itinerary.name,
+        'note': itinerary.note,
+        'trailheads': {
+            'id': [event.id for event in trailheads],
+            'site': [site_ref(event.site) for event in trailheads],
+            'datetime': [event.datetime.isoformat() for event in trailheads],
+            'note': [event.note for event in trailheads],
+        },
+        'stays': {
+            'id': [stay.id for stay in stays],
+            'site': [site_ref(stay.site) for stay in stays],
+            'arrive': [stay.arrive_datetime.isoformat() for stay in stays],
+            'depart': [stay.depart_datetime.isoformat() for stay in stays],
+            'arrive_id': [stay.event1.id for stay in stays],
+            'depart_id': [stay.event2.id for stay in stays],
+            'note': [stay.note for stay in stays],
+            'needs_permit': [int(stay.needs_permit) for stay in stays],
+        },
+        'routes': {
+            'id': [route.id for route in routes],
+            'site1': [site_ref(route.site1) for route in routes],
+            'site2': [site_ref(route.site2) for route in routes],
+            'name': [
+                None if route.name == route.default_name else route.name
+                for route in routes
+            ],
+            'note': [route.note for route in routes],
+            'features': [int(route.features) for route in routes],
+        },
+        'sites': site_columns,
+    }
+    return (_dumps(header) + '\n' + _dumps(body) + '\n').encode()
+
+
+def decode_header(line):
+    header = json.loads(line)
+    if header.get('schema', 0) > SCHEMA_VERSION:
+        raise SchemaError(
+            f'Itinerary {header.get("id")} uses schema {header["schema"]}, '
+            f'newer than this version of hiker understands'
+        )
+    return header
+
+
+@migration(1)
+def add_stay_event_ids(doc):
+    # Schema 1 didn't keep the ids of a stay's arrive and depart events;
+    # they get new ones, kept from the next save on.
+    stays = doc['stays']
+    stays['arrive_id'] = [events.uuid4() for _ in stays['id']]
+    stays['depart_id'] = [events.uuid4() for _ in stays['id']]
+    return {**doc, 'schema': 2}
+
+
+def upgrade(doc):
+    while doc['schema'] < SCHEMA_VERSION:
+        doc = MIGRATIONS[doc['schema']](doc)
+    return doc
+
+
+def decode(data):
+    header_line, body_line = data.split(b'\n', 2)[:2]
+    doc = upgrade({**decode_header(header_line), **json.loads(body_line)})
+    fromisoformat = datetime.fromisoformat
+
+    # Objects are filled in directly rather than through __init__, which
+    # would mint (and then discard) fresh ids for every one of them.
+    columns = doc['sites']
+    site_objects = []
+    for id, kind, location, elevation, name, features in zip(
+        columns['id'],
+        columns['kind'],
+        columns['location'],
+        columns['elevation'],
+        columns['name'],
+        columns['features'],
+    ):
+        site = SITE_KINDS[kind].__new__(SITE_KINDS[kind])
+        site.id = id
+        site.location = location
+        site.elevation = elevation
+        site._name = name
+        site._features = features
+        site_objects.append(site)
+
+    columns = doc['trailheads']
+    trailheads = []
+    for cls, id, site, dt, note in zip(
+        (events.StartTrailheadEvent, events.EndTrailheadEvent),
+        columns['id'],
+        columns['site'],
+        columns['datetime'],
+        columns['note'],
+    ):
+        event = cls.__new__(cls)
+        event.id = id
+        event.site = site_objects[site]
+        event.datetime = fromisoformat(dt)
+        event.note = note
+        trailheads.append(event)
+
+    columns = doc['stays']
+    stays = []
+    for (
+        id, site, arrive, depart, arrive_id, depart_id, note, needs_permit,
+    ) in zip(
+        columns['id'],
+        columns['site'],
+        columns['arrive'],
+        columns['depart'],
+        columns['arrive_id'],
+        columns['depart_id'],
+        columns['note'],
+        columns['needs_permit'],
+    ):
+        stay = events.Stay.__new__(events.Stay)
+        stay.id = id
+        stay.site = site_objects[site]
+        stay.event1 = _site_event(
+            events.SiteArriveEvent,
+            arrive_id,
+            fromisoformat(arrive),
+            stay.site,
+        )
+        stay.event2 = _site_event(
+            events.SiteDepartEvent,
+            depart_id,
+            fromisoformat(depart),
+            stay.site,
+        )
+        stay.note = note
+        stay.needs_permit = bool(needs_permit)
+        stays.append(stay)
+
+    columns = doc['routes']
+    routes = []
+    for id, site1, site2, name, note, features in zip(
+        columns['id'],
+        columns['site1'],
+        columns['site2'],
+        columns['name'],
+        columns['note'],
+        columns['features'],
+    ):
+        route = sites.Route.__new__(sites.Route)
+        route.id = id
+        route.site1 = site_objects[site1]
+        route.site2 = site_objects[site2]
+        route.name = route.default_name if name is None else name
+        route.note = note
+        route._features = features
+        routes.append(route)
+
+    itinerary = sites.Itinerary(
+        trailheads[0],
+        trailheads[1],
+        stays=stays,
+        routes=routes,
+        note=doc['note'],
+        name=doc['name'],
+    )
+    itinerary.id = doc['id']
+    itinerary.version = doc['version']
+    return itinerary
+
+
+def _site_event(cls, id, dt, site):
+    event = cls.__new__(cls)
+    event.id = id
+    event.datetime = dt
+    event.site = site
+    return event
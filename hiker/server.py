@@ -0,0 +1,111 @@
+import os
+import signal
+import sys
+from pathlib import Path
+
+from . import app, get_cfg
+
+DEFAULT_BIND = '127.0.0.1:5000'
+DEFAULT_THREADS = 4
+DEFAULT_KEEPALIVE = 5
+DEFAULT_TIMEOUT = 30
+DEFAULT_GRACEFUL_TIMEOUT = 30
+
+
+def default_workers():
+    return (os.cpu_count() or 1) * 2 + 1
+
+
+def pidfile(cfg):
+    return cfg.get('pidfile', str(Path(cfg['data_dir']) / 'hiker.pid'))
+
+
+def options(cfg, overrides=None):
+    # Gunicorn settings from config.yaml, e.g.
+    #     bind: 0.0.0.0:8000
+    #     workers: 4
+    #     threads: 8
+    #     keepalive: 5
+    #     timeout: 30
+    #     preload: true
+    # with anything given on the command line taking precedence.
+    settings = {
+        'bind': cfg.get('bind', DEFAULT_BIND),
+        'workers': cfg.get('workers', default_workers()),
+        'threads': cfg.get('threads', DEFAULT_THREADS),
+        'keepalive': cfg.get('keepalive', DEFAULT_KEEPALIVE),
+        'timeout': cfg.get('timeout', DEFAULT_TIMEOUT),
+        'graceful_timeout': cfg.get(
+            'graceful_timeout',
+            DEFAULT_GRACEFUL_TIMEOUT,
+        ),
+        'preload': cfg.get('preload', True),
+    }
+    settings.update(
+        (key, value)
+        for key, value in (overrides or {}).items()
+        if value is not None
+    )
+    return {
+        'bind': [settings['bind']],
+        'workers': settings['workers'],
+        # Threads share their worker's itinerary cache; that is safe as
+        # write views edit a private copy under a per-itinerary lock (see
+        # load_for_edit).
+        'threads': settings['threads'],
+        # The threaded worker, even with one thread, as the plain sync one
+        # ignores keepalive.
+        'worker_class': 'gthread',
+        'keepalive': settings['keepalive'],
+        'timeout': settings['timeout'],
+        'graceful_timeout': settings['graceful_timeout'],
+        'preload_app': settings['preload'],
+        'pidfile': pidfile(cfg),
+    }
+
+
+def warm():
+    # With preload this runs once in the master, so the workers it forks
+    # share the lazily imported modules and compiled templates instead of
+    # each paying for them on its first requests. Storage is left alone:
+    # connections are opened by each worker.
+    from . import exports, tracks  # noqa: F401
+    from .logic import planner, schedule, stats  # noqa: F401
+    for name in app.jinja_env.list_templates():
+        app.jinja_env.get_template(name)
+
+
+def serve(overrides=None):
+    try:
+        from gunicorn.app.base import BaseApplication
+    except ImportError:
+        sys.exit(
+            'Serving with worker processes needs gunicorn: '
+            'pip install gunicorn'
+        )
+
+    class Application(BaseApplication):
+
+        def load_config(self):
+            # Gunicorn calls this again on SIGHUP, so a graceful reload
+            # also picks up changes to config.yaml.
+            for key, value in options(get_cfg(), overrides).items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            warm()
+            return app
+
+    Application().run()
+
+
+def reload():
+    # Gunicorn starts new workers on SIGHUP and lets the old ones finish
+    # their requests. With preload, code changes need a full restart.
+    path = Path(pidfile(get_cfg()))
+    try:
+        pid = int(path.read_text())
+        os.kill(pid, signal.SIGHUP)
+    except (FileNotFoundError, ProcessLookupError):
+        sys.exit(f'No server running (see {path})')
+    return pid
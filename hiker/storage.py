@@ -0,0 +1,583 @@
+import os
+import pickle
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+
+from . import serialization
+from .database import Database
+from .journal import Journal
+from .locking import file_lock
+from .logic import sites, events
+from .logic.edits import apply_edit
+
+DEFAULT_JOURNAL_LIMIT = 64 * 1024
+
+
+class ItineraryNotFound(LookupError):
+    pass
+
+
+class VersionConflict(Exception):
+
+    def __init__(self, itinerary_id, expected, found):
+        super().__init__(
+            f'Itinerary {itinerary_id} is at version {found}, '
+            f'not {expected}'
+        )
+        self.itinerary_id = itinerary_id
+        self.expected = expected
+        self.found = found
+
+
+class FileStorage:
+
+    suffix = '.itinerary'
+    legacy_suffix = '.pkl'
+
+    def __init__(self, data_dir, journal_limit=DEFAULT_JOURNAL_LIMIT):
+        self.data_dir = Path(data_dir)
+        self.lock_dir = self.data_dir / '.locks'
+        self.lock_dir.mkdir(exist_ok=True)
+        self.journal_limit = journal_limit
+        self._guard = threading.Lock()
+        self._compacting = set()
+
+    def path(self, itinerary_id):
+        return self.data_dir / Path(str(itinerary_id)+self.suffix)
+
+    def legacy_path(self, itinerary_id):
+        return self.data_dir / Path(str(itinerary_id)+self.legacy_suffix)
+
+    def _snapshot_path(self, itinerary_id):
+        # Pickled snapshots are still read until their next save rewrites
+        # them in the current format.
+        path = self.path(itinerary_id)
+        if path.exists():
+            return path
+        legacy = self.legacy_path(itinerary_id)
+        if legacy.exists():
+            return legacy
+        raise ItineraryNotFound(itinerary_id)
+
+    def lock(self, itinerary_id):
+        return file_lock(self.lock_dir / f'{itinerary_id}.lock')
+
+    def journal(self, itinerary_id):
+        return Journal(self.data_dir / Path(str(itinerary_id)+'.journal'))
+
+    def ids(self):
+        return sorted({
+            int(path.stem)
+            for suffix in (self.suffix, self.legacy_suffix)
+            for path in self.data_dir.glob('*'+suffix)
+        })
+
+    def _stat(self, itinerary_id):
+        try:
+            return self._snapshot_path(itinerary_id).stat()
+        except FileNotFoundError:
+            raise ItineraryNotFound(itinerary_id) from None
+
+    def stamp(self, itinerary_id):
+        stat = self._stat(itinerary_id)
+        return (
+            stat.st_mtime_ns,
+            stat.st_size,
+            self.journal(itinerary_id).size(),
+        )
+
+    def mtime(self, itinerary_id):
+        return max(
+            self._stat(itinerary_id).st_mtime,
+            self.journal(itinerary_id).mtime(),
+        )
+
+    def _read_snapshot(self, itinerary_id, header_only=False):
+        # Both formats start with the version so it can be checked without
+        # decoding the itinerary.
+        try:
+            path = self._snapshot_path(itinerary_id)
+            with open(path, 'rb') as fh:
+                if path.suffix == self.legacy_suffix:
+                    return self._read_legacy(fh, header_only)
+                if header_only:
+                    header = serialization.decode_header(fh.readline())
+                    return header['version'], None
+                itinerary = serialization.decode(fh.read())
+                return itinerary.version, itinerary
+        except FileNotFoundError:
+            raise ItineraryNotFound(itinerary_id) from None
+
+    def _read_legacy(self, fh, header_only):
+        # Pickles written before the version header hold just the itinerary.
+        obj = pickle.load(fh)
+        if not isinstance(obj, int):
+            return getattr(obj, 'version', 0), obj
+        if header_only:
+            return obj, None
+        return obj, pickle.load(fh)
+
+    def version(self, itinerary_id):
+        records = self.journal(itinerary_id).records()
+        version = self._read_snapshot(itinerary_id, header_only=True)[0]
+        if records and records[-1][2] is not None:
+            return max(records[-1][2], version)
+        return version
+
+    def load(self, itinerary_id):
+        version, itinerary = self._read_snapshot(itinerary_id)
+        snapshot_version = version
+        for item_id, fields, record_version in (
+            self.journal(itinerary_id).records()
+        ):
+            # Loads don't take the lock, so the journal can still hold
+            # records from before a snapshot that has just replaced it.
+            if record_version is not None and (
+                record_version <= snapshot_version
+            ):
+                continue
+            try:
+                apply_edit(itinerary, item_id, fields)
+            except ValueError:
+                # The item was removed by a snapshot written after this
+                # record but before the journal was cleared.
+                pass
+            version = record_version or version
+        itinerary.version = version
+        return itinerary
+
+    def _write_snapshot(self, itinerary):
+        path = self.path(itinerary.id)
+        tmp = path.with_name(path.name + '.tmp')
+        with open(tmp, 'wb') as fh:
+            fh.write(serialization.encode(itinerary))
+            fh.flush()
+            os.fsync(fh.fileno())
+        os.replace(tmp, path)
+        self.legacy_path(itinerary.id).unlink(missing_ok=True)
+        self.journal(itinerary.id).clear()
+
+    def _check_version(self, itinerary):
+        try:
+            found = self.version(itinerary.id)
+        except ItineraryNotFound:
+            return
+        if found != itinerary.version:
+            raise VersionConflict(itinerary.id, itinerary.version, found)
+
+    def save(self, itinerary, changed=None):
+        with self.lock(itinerary.id):
+            self._check_version(itinerary)
+            itinerary.version += 1
+            try:
+                self._write_snapshot(itinerary)
+            except BaseException:
+                itinerary.version -= 1
+                raise
+            return self.stamp(itinerary.id)
+
+    def record(self, itinerary, item_id, fields, changed):
+        # Field edits are merged onto whatever version is on disk. If that
+        # is newer than ours, the caller's copy is stale and None is
+        # returned instead of a stamp.
+        journal = self.journal(itinerary.id)
+        with self.lock(itinerary.id):
+            found = self.version(itinerary.id)
+            journal.append(item_id, fields, found + 1)
+            stamp = self.stamp(itinerary.id)
+        if journal.size() > self.journal_limit:
+            self.compact_later(itinerary.id)
+        if found != itinerary.version:
+            return None
+        itinerary.version = found + 1
+        return stamp
+
+    def compact_later(self, itinerary_id):
+        with self._guard:
+            if itinerary_id in self._compacting:
+                return
+            self._compacting.add(itinerary_id)
+        threading.Thread(
+            target=self.compact,
+            args=(itinerary_id,),
+            daemon=True,
+        ).start()
+
+    def compact(self, itinerary_id):
+        with self._guard:
+            self._compacting.discard(itinerary_id)
+        with self.lock(itinerary_id):
+            try:
+                self._write_snapshot(self.load(itinerary_id))
+            except ItineraryNotFound:
+                pass
+
+    def delete(self, itinerary_id):
+        with self.lock(itinerary_id):
+            try:
+                self._snapshot_path(itinerary_id).unlink()
+            except FileNotFoundError:
+                raise ItineraryNotFound(itinerary_id) from None
+            self.legacy_path(itinerary_id).unlink(missing_ok=True)
+            self.journal(itinerary_id).clear()
+
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS itineraries (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    note TEXT NOT NULL,
+    version INTEGER NOT NULL,
+    mtime REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS sites (
+    itinerary_id INTEGER NOT NULL,
+    id INTEGER NOT NULL,
+    kind TEXT NOT NULL,
+    location NUMERIC NOT NULL,
+    elevation NUMERIC NOT NULL,
+    name TEXT NOT NULL,
+    water INTEGER NOT NULL,
+    PRIMARY KEY (itinerary_id, id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS stays (
+    itinerary_id INTEGER NOT NULL,
+    id INTEGER NOT NULL,
+    site_id INTEGER NOT NULL,
+    arrive TEXT NOT NULL,
+    depart TEXT NOT NULL,
+    note TEXT NOT NULL,
+    needs_permit INTEGER NOT NULL,
+    PRIMARY KEY (itinerary_id, id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS routes (
+    itinerary_id INTEGER NOT NULL,
+    id INTEGER NOT NULL,
+    site1_id INTEGER NOT NULL,
+    site2_id INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    note TEXT NOT NULL,
+    water INTEGER NOT NULL,
+    PRIMARY KEY (itinerary_id, id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS trailhead_events (
+    itinerary_id INTEGER NOT NULL,
+    id INTEGER NOT NULL,
+    kind TEXT NOT NULL,
+    site_id INTEGER NOT NULL,
+    datetime TEXT NOT NULL,
+    note TEXT NOT NULL,
+    PRIMARY KEY (itinerary_id, id)
+) WITHOUT ROWID;
+'''
+
+ITEM_TABLES = ('sites', 'stays', 'routes', 'trailhead_events')
+
+
+def _upsert(table, columns):
+    updates = ', '.join(f'{c} = excluded.{c}' for c in columns[2:])
+    return (
+        f'INSERT INTO {table} ({", ".join(columns)}) '
+        f'VALUES ({", ".join("?" * len(columns))}) '
+        f'ON CONFLICT (itinerary_id, id) DO UPDATE SET {updates}'
+    )
+
+
+UPSERT_SITE = _upsert(
+    'sites',
+    ('itinerary_id', 'id', 'kind', 'location', 'elevation', 'name', 'water'),
+)
+UPSERT_STAY = _upsert(
+    'stays',
+    (
+        'itinerary_id', 'id', 'site_id', 'arrive', 'depart', 'note',
+        'needs_permit',
+    ),
+)
+UPSERT_ROUTE = _upsert(
+    'routes',
+    ('itinerary_id', 'id', 'site1_id', 'site2_id', 'name', 'note', 'water'),
+)
+UPSERT_TRAILHEAD = _upsert(
+    'trailhead_events',
+    ('itinerary_id', 'id', 'kind', 'site_id', 'datetime', 'note'),
+)
+
+
+class SQLiteStorage(Database):
+
+    schema = SCHEMA
+
+    def ids(self):
+        return [
+            row[0]
+            for row in self.connection.execute('SELECT id FROM itineraries')
+        ]
+
+    def _header(self, itinerary_id):
+        row = self.connection.execute(
+            'SELECT name, note, version, mtime FROM itineraries WHERE id = ?',
+            (itinerary_id,),
+        ).fetchone()
+        if row is None:
+            raise ItineraryNotFound(itinerary_id)
+        return row
+
+    def stamp(self, itinerary_id):
+        return self._header(itinerary_id)[2]
+
+    def mtime(self, itinerary_id):
+        return self._header(itinerary_id)[3]
+
+    def load(self, itinerary_id):
+        with self.snapshot() as conn:
+            return self._load(conn, itinerary_id)
+
+    def _load(self, conn, itinerary_id):
+        name, note, version, _ = self._header(itinerary_id)
+        site_objects = {}
+        for id, kind, location, elevation, site_name, water in conn.execute(
+            'SELECT id, kind, location, elevation, name, water FROM sites '
+            'WHERE itinerary_id = ?',
+            (itinerary_id,),
+        ):
+            if kind == 'start':
+                site = sites.StartTrailhead(elevation, [], site_name)
+            elif kind == 'end':
+                site = sites.EndTrailhead(location, elevation, [], site_name)
+            else:
+                site = sites.Site(location, elevation, [], site_name)
+            site.location = location
+            site.id = id
+            if water:
+                site.add_water()
+            site_objects[id] = site
+        trailheads = {}
+        for id, kind, site_id, dt, event_note in conn.execute(
+            'SELECT id, kind, site_id, datetime, note FROM trailhead_events '
+            'WHERE itinerary_id = ?',
+            (itinerary_id,),
+        ):
+            if kind == 'start':
+                cls = events.StartTrailheadEvent
+            else:
+                cls = events.EndTrailheadEvent
+            event = cls(
+                datetime.fromisoformat(dt),
+                site_objects[site_id],
+                event_note,
+            )
+            event.id = id
+            trailheads[kind] = event
+        stays = []
+        for id, site_id, arrive, depart, stay_note, needs_permit in (
+            conn.execute(
+                'SELECT id, site_id, arrive, depart, note, needs_permit '
+                'FROM stays WHERE itinerary_id = ?',
+                (itinerary_id,),
+            )
+        ):
+            stay = events.Stay(
+                site_objects[site_id],
+                datetime.fromisoformat(arrive),
+                datetime.fromisoformat(depart),
+                stay_note,
+                bool(needs_permit),
+            )
+            stay.id = id
+            stays.append(stay)
+        routes = []
+        for id, site1_id, site2_id, route_name, route_note, water in (
+            conn.execute(
+                'SELECT id, site1_id, site2_id, name, note, water FROM routes '
+                'WHERE itinerary_id = ?',
+                (itinerary_id,),
+            )
+        ):
+            route = sites.Route(
+                site_objects[site1_id],
+                site_objects[site2_id],
+                [],
+                route_note,
+                route_name,
+            )
+            route.id = id
+            if water:
+                route.add_water()
+            routes.append(route)
+        itinerary = sites.Itinerary(
+            trailheads['start'],
+            trailheads['end'],
+            stays=stays,
+            routes=routes,
+            note=note,
+            name=name,
+        )
+        itinerary.id = itinerary_id
+        itinerary.version = version
+        return itinerary
+
+    def _write(self, conn, itinerary, changed):
+        row = conn.execute(
+            'SELECT version FROM itineraries WHERE id = ?',
+            (itinerary.id,),
+        ).fetchone()
+        if row is not None and row[0] != itinerary.version:
+            raise VersionConflict(itinerary.id, itinerary.version, row[0])
+        version = itinerary.version + 1
+        conn.execute(
+            'INSERT INTO itineraries (id, name, note, version, mtime) '
+            'VALUES (?, ?, ?, ?, ?) '
+            'ON CONFLICT (id) DO UPDATE SET name = excluded.name, '
+            'note = excluded.note, version = excluded.version, '
+            'mtime = excluded.mtime',
+            (
+                itinerary.id,
+                itinerary.name,
+                itinerary.note,
+                version,
+                time.time(),
+            ),
+        )
+        if changed is None:
+            for table in ITEM_TABLES:
+                conn.execute(
+                    f'DELETE FROM {table} WHERE itinerary_id = ?',
+                    (itinerary.id,),
+                )
+            changed = itinerary.traverse()
+        for item in changed:
+            if item is itinerary:
+                continue
+            if item in itinerary:
+                self._write_item(conn, itinerary.id, item)
+            else:
+                self._delete_item(conn, itinerary.id, item)
+        return version
+
+    def save(self, itinerary, changed=None):
+        with self.transaction() as conn:
+            version = self._write(conn, itinerary, changed)
+        itinerary.version = version
+        return version
+
+    def _write_item(self, conn, itinerary_id, item):
+        if isinstance(item, sites.Route):
+            conn.execute(UPSERT_ROUTE, (
+                itinerary_id,
+                item.id,
+                item.site1.id,
+                item.site2.id,
+                item.name,
+                item.note,
+                int(item.has_water),
+            ))
+            return
+        if isinstance(item, events.Stay):
+            kind = 'site'
+            conn.execute(UPSERT_STAY, (
+                itinerary_id,
+                item.id,
+                item.site.id,
+                item.arrive_datetime.isoformat(),
+                item.depart_datetime.isoformat(),
+                item.note,
+                int(item.needs_permit),
+            ))
+        else:
+            if isinstance(item, events.StartTrailheadEvent):
+                kind = 'start'
+            else:
+                kind = 'end'
+            conn.execute(UPSERT_TRAILHEAD, (
+                itinerary_id,
+                item.id,
+                kind,
+                item.site.id,
+                item.datetime.isoformat(),
+                item.note,
+            ))
+        conn.execute(UPSERT_SITE, (
+            itinerary_id,
+            item.site.id,
+            kind,
+            item.site.location,
+            item.site.elevation,
+            item.site.name,
+            int(item.site.has_water),
+        ))
+
+    def _delete_item(self, conn, itinerary_id, item):
+        if isinstance(item, sites.Route):
+            table = 'routes'
+        else:
+            table = 'stays'
+            conn.execute(
+                'DELETE FROM sites WHERE itinerary_id = ? AND id = ?',
+                (itinerary_id, item.site.id),
+            )
+        conn.execute(
+            f'DELETE FROM {table} WHERE itinerary_id = ? AND id = ?',
+            (itinerary_id, item.id),
+        )
+
+    def delete(self, itinerary_id):
+        with self.transaction() as conn:
+            deleted = conn.execute(
+                'DELETE FROM itineraries WHERE id = ?',
+                (itinerary_id,),
+            ).rowcount
+            for table in ITEM_TABLES:
+                conn.execute(
+                    f'DELETE FROM {table} WHERE itinerary_id = ?',
+                    (itinerary_id,),
+                )
+        if not deleted:
+            raise ItineraryNotFound(itinerary_id)
+
+    def record(self, itinerary, item_id, fields, changed):
+        # On a conflict the edit is re-applied to the stored itinerary, and
+        # None tells the caller its own copy is stale.
+        try:
+            return self.save(itinerary, changed)
+        except VersionConflict:
+            pass
+        with self.transaction() as conn:
+            current = self.load(itinerary.id)
+            self._write(conn, current, apply_edit(current, item_id, fields))
+        return None
+
+
+def open_storage(cfg):
+    data_dir = Path(cfg['data_dir'])
+    kind = cfg.get('storage', 'pickle')
+    if kind == 'pickle':
+        return FileStorage(
+            data_dir,
+            cfg.get('journal_limit', DEFAULT_JOURNAL_LIMIT),
+        )
+    if kind == 'sqlite':
+        return SQLiteStorage(cfg.get('sqlite_path', data_dir / 'hiker.sqlite'))
+    raise ValueError(f'Unknown storage backend: {kind}')
+
+
+def migrate(source, target):
+    # Copies the itineraries the target doesn't have yet, so it can be run
+    # again, or after an interrupted run, without touching those it has.
+    # Returns how many were copied and how many skipped.
+    existing = set(target.ids())
+    copied = skipped = 0
+    for itinerary_id in source.ids():
+        if itinerary_id in existing:
+            skipped += 1
+            continue
+        try:
+            target.save(source.load(itinerary_id))
+        except VersionConflict:
+            # Saved to the target by someone else meanwhile.
+            skipped += 1
+            continue
+        copied += 1
+    return copied, skipped
@@ -0,0 +1,187 @@
+import os
+from array import array
+from pathlib import Path
+from xml.etree import ElementTree
+
+import numpy as np
+
+from .logic.edits import apply_edit
+
+# Locations are miles along the trail and elevations are feet.
+METERS_PER_MILE = 1609.344
+METERS_PER_FOOT = 0.3048
+EARTH_RADIUS = 6371008.8
+# How far, in metres, the simplified track may stray from the recorded one.
+DEFAULT_TOLERANCE = 5.0
+
+# Columns of a stored track.
+DISTANCE, LAT, LON, ELEVATION = range(4)
+
+
+class TrackError(ValueError):
+    pass
+
+
+def track_path(data_dir, itinerary_id):
+    return Path(data_dir) / f'{itinerary_id}.track.npy'
+
+
+def _local(tag):
+    return tag.rpartition('}')[2]
+
+
+def read_gpx(fh):
+    # Points are streamed straight into flat arrays of doubles and each
+    # element is dropped from the tree once read, so memory stays at 24
+    # bytes per point however large the file is.
+    lat, lon, ele = array('d'), array('d'), array('d')
+    parents = []
+    try:
+        for event, elem in ElementTree.iterparse(fh, events=('start', 'end')):
+            if event == 'start':
+                parents.append(elem)
+                continue
+            parents.pop()
+            if _local(elem.tag) not in ('trkpt', 'rtept'):
+                continue
+            lat.append(float(elem.get('lat')))
+            lon.append(float(elem.get('lon')))
+            elevation = next(
+                (child.text for child in elem if _local(child.tag) == 'ele'),
+                None,
+            )
+            ele.append(float(elevation) if elevation else np.nan)
+            if parents:
+                parents[-1].remove(elem)
+    except (ElementTree.ParseError, TypeError, ValueError) as exc:
+        raise TrackError(f'Not a readable GPX file: {exc}') from None
+    if len(lat) < 2:
+        raise TrackError('The GPX file has fewer than two track points')
+    return np.frombuffer(lat), np.frombuffer(lon), np.frombuffer(ele)
+
+
+def project(lat, lon):
+    # Equirectangular projection around the track's middle, in metres;
+    # plenty accurate over the length of a hike.
+    phi = np.radians(lat)
+    lam = np.radians(lon)
+    x = EARTH_RADIUS * lam * np.cos(np.median(phi))
+    y = EARTH_RADIUS * phi
+    return x, y
+
+
+def haversine(lat, lon):
+    phi = np.radians(lat)
+    dphi = np.diff(phi)
+    dlam = np.diff(np.radians(lon))
+    a = (
+        np.sin(dphi / 2) ** 2
+        + np.cos(phi[:-1]) * np.cos(phi[1:]) * np.sin(dlam / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(a))
+
+
+def fill_gaps(values):
+    missing = np.isnan(values)
+    if missing.all():
+        return np.zeros_like(values)
+    if missing.any():
+        index = np.arange(len(values))
+        values = values.copy()
+        values[missing] = np.interp(
+            index[missing], index[~missing], values[~missing],
+        )
+    return values
+
+
+def simplify(x, y, z, tolerance):
+    # Douglas-Peucker in three dimensions, so climbs survive as well as
+    # turns. Iterative, with the distance scan over each span vectorized.
+    keep = np.zeros(len(x), dtype=bool)
+    keep[0] = keep[-1] = True
+    spans = [(0, len(x) - 1)]
+    while spans:
+        first, last = spans.pop()
+        if last - first < 2:
+            continue
+        direction = np.array(
+            [x[last] - x[first], y[last] - y[first], z[last] - z[first]],
+        )
+        offset = np.stack([
+            x[first + 1:last] - x[first],
+            y[first + 1:last] - y[first],
+            z[first + 1:last] - z[first],
+        ], axis=1)
+        norm = np.linalg.norm(direction)
+        if norm:
+            distance = np.linalg.norm(np.cross(offset, direction), axis=1)
+            distance /= norm
+        else:
+            distance = np.linalg.norm(offset, axis=1)
+        i = int(np.argmax(distance))
+        if distance[i] > tolerance:
+            i += first + 1
+            keep[i] = True
+            spans.append((first, i))
+            spans.append((i, last))
+    return np.flatnonzero(keep)
+
+
+def import_gpx(fh, path, tolerance=DEFAULT_TOLERANCE):
+    lat, lon, ele = read_gpx(fh)
+    ele = fill_gaps(ele)
+    # Distances are summed over the full track before it is simplified,
+    # so the simplified one still has the true length.
+    distance = np.concatenate([[0], np.cumsum(haversine(lat, lon))])
+    x, y = project(lat, lon)
+    kept = simplify(x, y, ele, tolerance)
+    track = np.empty((len(kept), 4))
+    track[:, DISTANCE] = distance[kept] / METERS_PER_MILE
+    track[:, LAT] = lat[kept]
+    track[:, LON] = lon[kept]
+    track[:, ELEVATION] = ele[kept] / METERS_PER_FOOT
+    path = Path(path)
+    tmp = path.with_name(path.name + '.tmp')
+    with open(tmp, 'wb') as fh:
+        np.save(fh, track)
+        fh.flush()
+        os.fsync(fh.fileno())
+    os.replace(tmp, path)
+    return load_track(path)
+
+
+def load_track(path):
+    try:
+        return np.load(path, mmap_mode='r')
+    except FileNotFoundError:
+        return None
+
+
+def delete_track(path):
+    Path(path).unlink(missing_ok=True)
+
+
+def snap(itinerary, track):
+    # Moves the end trailhead to the end of the track, keeps every other
+    # site on it, and takes all elevations from it. Returns the changed
+    # items.
+    distance = track[:, DISTANCE]
+    events = [
+        itinerary.starttrailhead_event,
+        *itinerary.stays,
+        itinerary.endtrailhead_event,
+    ]
+    locations = np.clip(
+        [event.site.location for event in events[:-1]] + [distance[-1]],
+        0,
+        distance[-1],
+    )
+    elevations = np.interp(locations, distance, track[:, ELEVATION])
+    changed = {}
+    for event, location, elevation in zip(events, locations, elevations):
+        fields = {'elevation': int(round(elevation))}
+        if location != event.site.location:
+            fields['location'] = round(float(location), 2)
+        for item in apply_edit(itinerary, event.id, fields):
+            changed[id(item)] = item
+    return list(changed.values())
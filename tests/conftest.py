@@ -0,0 +1,48 @@
+import os
+import sys
+import tempfile
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+# The app reads its config when imported, so it must not find the user's.
+SCRATCH = tempfile.mkdtemp(prefix='hiker-test-')
+os.environ['XDG_CONFIG_HOME'] = os.path.join(SCRATCH, 'config')
+os.environ['XDG_DATA_HOME'] = os.path.join(SCRATCH, 'data')
+os.makedirs(os.path.join(SCRATCH, 'data'), exist_ok=True)
+sys.path.insert(0, str(ROOT))
+
+import hiker  # noqa: E402
+from hiker.config import Config  # noqa: E402
+from hiker.logic import events, sites  # noqa: E402
+
+START = datetime(2024, 6, 1, 8)
+
+
+def make_itinerary():
+    return sites.Itinerary(
+        events.StartTrailheadEvent(START, sites.StartTrailhead(0)),
+        events.EndTrailheadEvent(
+            START + timedelta(days=365),
+            sites.EndTrailhead(10000, 0),
+        ),
+    )
+
+
+def make_stay(n):
+    arrive = START + timedelta(hours=n + 1)
+    return events.Stay(sites.Site(n + 1, 0), arrive, arrive)
+
+
+@pytest.fixture(params=['pickle', 'sqlite'])
+def cfg(request, tmp_path):
+    import yaml
+    cfg = {'data_dir': str(tmp_path), 'storage': request.param}
+    path = tmp_path / 'config.yaml'
+    with open(path, 'w') as fh:
+        yaml.dump(cfg, fh)
+    hiker.config = Config(path)
+    hiker.cache.clear()
+    return cfg
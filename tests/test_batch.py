@@ -0,0 +1,43 @@
+import pytest
+
+import hiker
+from conftest import make_itinerary, make_stay
+from hiker.storage import open_storage
+
+BAD_OPERATIONS = [
+    {'op': 'add_stay', 'fields': {'location': 'abc'}},
+    {'op': 'add_stay', 'fields': {'location': 5, 'elevation': None}},
+    {'op': 'add_stay', 'fields': {'location': 5, 'name': None}},
+    {'op': 'add_stay', 'fields': {'location': 5, 'needs_permit': 'yes'}},
+    {'op': 'add_stay', 'fields': {'location': 5, 'arrive_datetime': 5}},
+    {'op': 'add_stay', 'fields': {'location': True}},
+    {'op': 'edit', 'fields': {'name': None}},
+    {'op': 'edit', 'fields': {'note': 3}},
+    {'op': 'rename', 'name': ['a', 'list']},
+]
+
+
+@pytest.mark.parametrize('operation', BAD_OPERATIONS)
+def test_bad_batch_leaves_itinerary_unchanged(cfg, operation):
+    storage = open_storage(cfg)
+    itinerary = make_itinerary()
+    itinerary.add_stay(make_stay(1))
+    storage.save(itinerary)
+    stay = itinerary.stays[0]
+    if operation['op'] == 'edit':
+        operation = {**operation, 'id': stay.id}
+    client = hiker.app.test_client()
+    response = client.post(
+        f'/api/itinerary/{itinerary.id}/batch',
+        json={'operations': [
+            {'op': 'edit', 'id': stay.id, 'fields': {'note': 'changed'}},
+            operation,
+        ]},
+    )
+    assert response.status_code == 400
+    assert response.get_json()['index'] == 1
+    saved = open_storage(cfg).load(itinerary.id)
+    assert saved.version == itinerary.version
+    assert [(stay.id, stay.note) for stay in saved.stays] == [(stay.id, '')]
+    assert client.get(f'/overview/{itinerary.id}').status_code == 200
+    assert client.get(f'/stats/{itinerary.id}').status_code == 200
@@ -0,0 +1,114 @@
+import threading
+
+import pytest
+
+import hiker
+from conftest import make_itinerary, make_stay
+from hiker.storage import VersionConflict, open_storage
+
+THREADS = 4
+REQUESTS = 40
+
+
+def test_concurrent_edits(cfg):
+    storage = open_storage(cfg)
+    itinerary = make_itinerary()
+    storage.save(itinerary)
+    statuses = []
+    errors = []
+
+    def write(thread):
+        client = hiker.app.test_client()
+        for i in range(REQUESTS):
+            n = thread * REQUESTS + i
+            response = client.post(
+                f'/api/itinerary/{itinerary.id}/batch',
+                json={'operations': [{'op': 'add_stay', 'fields': {
+                    'location': n + 1,
+                    'arrive_datetime': make_stay(n).arrive_datetime
+                    .isoformat(),
+                    'depart_datetime': make_stay(n).depart_datetime
+                    .isoformat(),
+                }}]},
+            )
+            statuses.append(response.status_code)
+
+    def read():
+        client = hiker.app.test_client()
+        while len(statuses) < THREADS * REQUESTS:
+            response = client.get(f'/overview/{itinerary.id}')
+            if response.status_code != 200:
+                errors.append(response.status_code)
+
+    threads = [
+        threading.Thread(target=write, args=(thread,))
+        for thread in range(THREADS)
+    ]
+    threads.append(threading.Thread(target=read))
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    saved = len(open_storage(cfg).load(itinerary.id).stays)
+    assert set(statuses) <= {200, 409}
+    assert not errors
+    # A rejected edit must not have been saved by anyone else either.
+    assert statuses.count(409) + saved == THREADS * REQUESTS
+    assert statuses.count(200) == saved
+    # Threads of one process take turns rather than conflicting.
+    assert statuses.count(409) == 0
+
+
+def test_conflict_leaves_storage_unchanged(cfg):
+    storage = open_storage(cfg)
+    itinerary = make_itinerary()
+    storage.save(itinerary)
+    first = storage.load(itinerary.id)
+    second = storage.load(itinerary.id)
+    first.add_stay(make_stay(1))
+    storage.save(first)
+    second.add_stay(make_stay(2))
+    with pytest.raises(VersionConflict):
+        storage.save(second)
+    saved = storage.load(itinerary.id)
+    assert saved.version == first.version
+    assert [stay.id for stay in saved.stays] == [
+        stay.id for stay in first.stays
+    ]
+
+
+def test_journal_older_than_snapshot_is_skipped(cfg):
+    if cfg['storage'] != 'pickle':
+        pytest.skip('only file storage keeps a journal')
+    storage = open_storage(cfg)
+    itinerary = make_itinerary()
+    itinerary.add_stay(make_stay(1))
+    storage.save(itinerary)
+    stay = itinerary.stays[0]
+    storage.record(itinerary, stay.id, {'note': 'old'}, [stay])
+    journal = storage.journal(itinerary.id)
+    records = journal.path.read_bytes()
+    # A newer snapshot, read before the journal it replaces was cleared.
+    itinerary.get_item(stay.id).note = 'new'
+    storage.save(itinerary)
+    journal.path.write_bytes(records)
+    loaded = storage.load(itinerary.id)
+    assert loaded.version == itinerary.version
+    assert loaded.get_item(stay.id).note == 'new'
+
+
+def test_stale_edit_indexes_saved_copy(cfg):
+    storage = open_storage(cfg)
+    itinerary = make_itinerary()
+    itinerary.add_stay(make_stay(1))
+    storage.save(itinerary)
+    stale = storage.load(itinerary.id)
+    fresh = storage.load(itinerary.id)
+    with hiker.app.test_request_context():
+        hiker.edit_itinerary(fresh, None, {'name': 'Renamed'})
+        hiker.edit_itinerary(stale, stale.stays[0].id, {'note': 'late'})
+        entry = hiker.get_catalog().entries()[itinerary.id]
+        results = hiker.get_search_index().search('late')
+    assert entry['name'] == 'Renamed'
+    assert [result['itinerary_name'] for result in results] == ['Renamed']
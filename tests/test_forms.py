@@ -0,0 +1,17 @@
+from datetime import datetime, timedelta
+
+from hiker.forms import parse_datetime
+
+
+def test_relative_text_follows_the_clock():
+    first = datetime(2024, 6, 1, 8)
+    second = first + timedelta(minutes=90)
+    assert parse_datetime('in 1 hour', first) == first + timedelta(hours=1)
+    assert parse_datetime('in 1 hour', second) == second + timedelta(hours=1)
+    assert parse_datetime('tomorrow', second) == second + timedelta(days=1)
+
+
+def test_absolute_text_ignores_the_clock():
+    expected = datetime(2024, 6, 5, 15)
+    assert parse_datetime('June 5 2024 3pm', datetime(2024, 1, 1)) == expected
+    assert parse_datetime('June 5 2024 3pm', datetime(2030, 1, 1)) == expected
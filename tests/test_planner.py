@@ -0,0 +1,75 @@
+import itertools
+import random
+
+import pytest
+
+from hiker.logic import planner
+
+
+def route_cost(profile, route, constraints):
+    # The sum of squared daily efforts, or None if a day is over a limit.
+    # Climb counts every candidate in the profile, eligible or not.
+    cost = 0
+    for a, b in zip(route, route[1:]):
+        distance = b.location - a.location
+        climb = sum(
+            max(second.elevation - first.elevation, 0)
+            for first, second in zip(profile, profile[1:])
+            if a.location <= first.location and second.location <= b.location
+        )
+        if distance > constraints.max_distance or climb > constraints.max_gain:
+            return None
+        cost += (distance + climb / planner.FEET_PER_MILE_OF_EFFORT) ** 2
+    return cost
+
+
+def brute_force(profile, constraints, nights):
+    # Tries every subset of the eligible candidates. Returns the nights and
+    # cost of the best plan, fewest nights first, or None if none fits.
+    start, *inside, end = profile
+    eligible = [c for c in inside if constraints.allows(c)]
+    sizes = range(len(eligible) + 1) if nights is None else [nights]
+    for size in sizes:
+        costs = [
+            route_cost(profile, [start, *stays, end], constraints)
+            for stays in itertools.combinations(eligible, size)
+        ]
+        costs = [cost for cost in costs if cost is not None]
+        if costs:
+            return size, min(costs)
+    return None
+
+
+@pytest.mark.parametrize('seed', range(200))
+def test_plan_matches_brute_force(seed):
+    rng = random.Random(seed)
+    length = rng.uniform(10, 40)
+    start = planner.Candidate(0, rng.randrange(3000))
+    end = planner.Candidate(length, rng.randrange(3000))
+    candidates = [
+        planner.Candidate(
+            rng.uniform(0, length),
+            rng.randrange(3000),
+            has_water=rng.random() < 0.7,
+            needs_permit=rng.random() < 0.2,
+        )
+        for _ in range(rng.randrange(13))
+    ]
+    constraints = planner.Constraints(
+        rng.uniform(8, 25),
+        rng.choice([None, rng.uniform(1000, 6000)]),
+        rng.random() < 0.3,
+        rng.random() < 0.3,
+    )
+    nights = rng.choice([None, None, rng.randrange(6)])
+    profile = sorted([*candidates, start, end], key=lambda c: c.location)
+    expected = brute_force(profile, constraints, nights)
+    if expected is None:
+        with pytest.raises(planner.PlanError):
+            planner.plan(candidates, start, end, constraints, nights)
+        return
+    stays = planner.plan(candidates, start, end, constraints, nights)
+    assert all(constraints.allows(stay) for stay in stays)
+    cost = route_cost(profile, [start, *stays, end], constraints)
+    assert cost is not None
+    assert (len(stays), cost) == (expected[0], pytest.approx(expected[1]))
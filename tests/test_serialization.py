@@ -0,0 +1,32 @@
+import json
+
+from conftest import make_itinerary, make_stay
+from hiker import serialization
+
+
+def stay_events(itinerary):
+    return [(stay.event1.id, stay.event2.id) for stay in itinerary.stays]
+
+
+def test_round_trip_keeps_stay_event_ids():
+    itinerary = make_itinerary()
+    itinerary.add_stay(make_stay(1))
+    decoded = serialization.decode(serialization.encode(itinerary))
+    assert stay_events(decoded) == stay_events(itinerary)
+
+
+def test_schema_1_is_upgraded():
+    itinerary = make_itinerary()
+    itinerary.add_stay(make_stay(1))
+    header, body = serialization.encode(itinerary).splitlines()
+    header, body = json.loads(header), json.loads(body)
+    header['schema'] = 1
+    del body['stays']['arrive_id'], body['stays']['depart_id']
+    old = (json.dumps(header) + '\n' + json.dumps(body) + '\n').encode()
+    decoded = serialization.decode(old)
+    assert [stay.id for stay in decoded.stays] == [
+        stay.id for stay in itinerary.stays
+    ]
+    assert None not in stay_events(decoded)[0]
+    again = serialization.decode(serialization.encode(decoded))
+    assert stay_events(again) == stay_events(decoded)
@@ -0,0 +1,17 @@
+from conftest import make_itinerary, make_stay
+from hiker.storage import FileStorage, SQLiteStorage, migrate
+
+
+def test_migrate_again_copies_only_new_itineraries(tmp_path):
+    source = FileStorage(tmp_path)
+    target = SQLiteStorage(tmp_path / 'hiker.sqlite')
+    first = make_itinerary()
+    first.add_stay(make_stay(1))
+    source.save(first)
+    assert migrate(source, target) == (1, 0)
+    second = make_itinerary()
+    source.save(second)
+    assert migrate(source, target) == (1, 1)
+    assert migrate(source, target) == (0, 2)
+    assert sorted(target.ids()) == sorted([first.id, second.id])
+    assert len(target.load(first.id).stays) == 1
@@ -0,0 +1,69 @@
+import random
+
+import pytest
+
+from conftest import make_itinerary, make_stay
+from hiker.logic.edits import apply_edit
+from hiker.logic.water import source_location
+
+
+def full_scan(itinerary):
+    # The longest stretch without water and every source, from scratch.
+    start = itinerary.starttrailhead_event.site.location
+    end = itinerary.endtrailhead_event.site.location
+    sources = sorted({
+        location
+        for location in map(source_location, itinerary.traverse())
+        if location is not None
+    })
+    points = [start, *(x for x in sources if start < x < end), end]
+    lengths = [right - left for left, right in zip(points, points[1:])]
+    return max((x for x in lengths if x > 0), default=None), sources
+
+
+def random_edit(rng, itinerary):
+    stays = itinerary.stays
+    choice = rng.random()
+    if choice < 0.3 or not stays:
+        stay = make_stay(rng.randrange(100))
+        stay.site.location = rng.randrange(-5, 105)
+        if rng.random() < 0.5:
+            stay.site.add_water()
+        itinerary.add_stay(stay)
+    elif choice < 0.45:
+        itinerary.remove_stay(rng.choice(stays))
+    elif choice < 0.6:
+        apply_edit(itinerary, rng.choice(stays).id, {
+            'location': rng.randrange(-5, 105),
+        })
+    elif choice < 0.9:
+        item = rng.choice([*stays, *itinerary.routes])
+        apply_edit(itinerary, item.id, {'has_water': rng.random() < 0.5})
+    else:
+        event = rng.choice([
+            itinerary.starttrailhead_event,
+            itinerary.endtrailhead_event,
+        ])
+        apply_edit(itinerary, event.id, {'location': rng.randrange(0, 100)})
+
+
+@pytest.mark.parametrize('seed', range(50))
+def test_index_matches_full_scan(seed):
+    rng = random.Random(seed)
+    itinerary = make_itinerary()
+    apply_edit(itinerary, itinerary.endtrailhead_event.id, {'location': 100})
+    index = itinerary.water_index()
+    for _ in range(200):
+        random_edit(rng, itinerary)
+        assert itinerary.water_index() is index
+        longest, sources = full_scan(itinerary)
+        gaps = list(index._gaps)
+        gap = index.max_gap()
+        # Queries must not change the index; cached copies are shared.
+        assert index._gaps == gaps
+        assert (gap and gap[1] - gap[0]) == longest
+        assert index.locations() == sources
+        location = rng.randrange(-5, 105)
+        assert index.next_water(location) == next(
+            (x for x in sources if x >= location), None,
+        )